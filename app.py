@@ -1,27 +1,313 @@
 #Libraries
+import threading
+
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import geopandas as gpd
-import plotly.graph_objects as go
-import plotly.express as px
+import dataEngine
+import figureEngine
+import geoEngine
+import perfMonitor
+import storeEngine
+# the plotting stack loads the first time a page draws a chart, the welcome page never pulls it in
+px = figureEngine.LazyModule("plotly.express")
+go = figureEngine.LazyModule("plotly.graph_objects")
 #******************************************************************************************************************************
 # Loader
+# parsed frames are memoized on a hash of the uploaded bytes, so reruns never re-parse a file already seen,
+# files too big for memory become a memory-mapped store instead of a frame
 def loaderFunction(pathFile):
-    data = pd.read_csv(pathFile)
-    data = data.dropna(axis=1, how='all')
+    ingestionMode = st.session_state.get("ingestionMode", "Auto")
+    streaming = None if ingestionMode in ("Auto", "Out-of-core") else ingestionMode == "Streaming"
+    progressBar = []
+
+    # only called while a new file is actually being streamed in
+    def reportProgress(fraction):
+        # the last block of a file is usually partial, counting whole blocks overshoots
+        fraction = min(fraction, 1.0)
+        if not progressBar:
+            progressBar.append(st.progress(0.0, text="Reading file in chunks..."))
+        progressBar[0].progress(fraction, text=f"Reading file in chunks... {fraction:.0%}")
+
+    data = None
+    if ingestionMode == "Out-of-core" or (ingestionMode == "Auto" and storeEngine.wantsStore(pathFile)):
+        try:
+            with perf.stage("load:store"):
+                data = storeEngine.openStore(pathFile, progress=reportProgress)
+        except (ImportError, OSError, ValueError) as exc:
+            st.error(f"Could not open the file out of core, loading it in memory instead: {exc}")
+    if data is None:
+        with perf.stage("load"):
+            data = dataEngine.loadCsv(pathFile, streaming=streaming, progress=reportProgress)
+    if progressBar:
+        progressBar[0].empty()
     return data
 #******************************************************************************************************************************
+# Uploads are parsed once per session and reused by every page whose columns they cover
+NO_DATASET = "(none)"
+
+
+def datasetRegistry():
+    if "datasetRegistry" not in st.session_state:
+        st.session_state["datasetRegistry"] = dataEngine.DatasetRegistry()
+    return st.session_state["datasetRegistry"]
+
+
+def datasetPicker(page, label):
+    registry = datasetRegistry()
+    pathFile = st.file_uploader(label, type=["csv"])
+    if pathFile is not None:
+        data = loaderFunction(pathFile)
+        registry.bind(page, registry.register(pathFile.name, data))
+        return appendRelease(page, data)
+    required = REQUIRED_COLUMNS.get(page, ['Year'])
+    choices = registry.compatible(required)
+    if not choices:
+        return None
+    # a page with a specific schema picks the newest match by itself, generic pages wait to be told
+    current = registry.binding(page)
+    if current not in choices:
+        current = choices[0] if page in REQUIRED_COLUMNS else NO_DATASET
+    options = [NO_DATASET] + choices
+    name = st.selectbox("Or use a dataset uploaded earlier in this session:", options, index=options.index(current),
+                        key=f"dataset_{page}")
+    registry.bind(page, None if name == NO_DATASET else name)
+    return None if name == NO_DATASET else appendRelease(page, registry.get(name))
+#******************************************************************************************************************************
+# A new release only carries the new years, they are appended to the page's dataset instead of re-uploading it all
+def appendRelease(page, data):
+    # out-of-core stores are read-only, a new release goes into a new store with the whole file
+    if storeEngine.isStore(data):
+        return data
+    registry = datasetRegistry()
+    with st.expander("Append a new data release"):
+        deltaFile = st.file_uploader("Upload a CSV with only the new years, same columns as the dataset", type=["csv"],
+                                     key=f"append_{page}")
+    if deltaFile is None:
+        return data
+    try:
+        with perf.stage("load:append"):
+            appended = dataEngine.appendCsv(data, deltaFile)
+    except ValueError as exc:
+        st.error(f"Could not append {deltaFile.name}: {exc}")
+        return data
+    if appended is not data:
+        registry.bind(page, registry.register(f"{registry.binding(page)} + {deltaFile.name}", appended))
+        st.caption(f"{len(appended) - len(data):,} rows from {deltaFile.name} appended.")
+    return appended
+#******************************************************************************************************************************
+# Every sheet of a workbook is parsed in parallel and registered, the first time it is seen each sheet is also
+# handed to the page it belongs to
+def workbookUpload(workbookFile):
+    registry = datasetRegistry()
+    progressBar = []
+
+    def reportProgress(fraction):
+        fraction = min(fraction, 1.0)
+        if not progressBar:
+            progressBar.append(st.progress(0.0, text="Parsing workbook sheets..."))
+        progressBar[0].progress(fraction, text=f"Parsing workbook sheets... {fraction:.0%}")
+
+    try:
+        with perf.stage("load:workbook"):
+            workbookKey, sheets = dataEngine.loadWorkbook(workbookFile, progress=reportProgress)
+    except ImportError as exc:
+        st.error(f"Reading workbooks needs an Excel engine: {exc}")
+        return
+    except Exception as exc:
+        # this runs in the sidebar before any page, a broken workbook must not take every page down with it
+        if progressBar:
+            progressBar[0].empty()
+        st.error(f"Could not read {workbookFile.name}: {exc}")
+        return
+    if progressBar:
+        progressBar[0].empty()
+    newWorkbook = st.session_state.get("workbookKey") != workbookKey
+    for sheetName, data in sheets.items():
+        name = registry.register(f"{workbookFile.name} / {sheetName}", data)
+        page = dataEngine.pageForSheet(sheetName)
+        if newWorkbook and page is not None:
+            registry.bind(page, name)
+    st.session_state["workbookKey"] = workbookKey
+    st.caption(f"{len(sheets)} sheets loaded: " + ", ".join(sheets))
+#******************************************************************************************************************************
+# statistics and handled frames are cached per dataset, handled frames get their own dataset key
 def  caterNullVals(data, nullHandlingOption):
-    if nullHandlingOption == "Remove Null":
-        cleanedData = data.dropna()
-        return cleanedData
-    elif nullHandlingOption == "Impute by Mode":
-        data_imputed = data.fillna(data.mode().iloc[0])
-        return data_imputed
-    else:
+    with perf.stage("null handling"):
+        return dataEngine.handleNulls(data, nullHandlingOption)
+#******************************************************************************************************************************
+# Data profile, computed once per upload, the expensive sections only when switched on
+def profilePanel(data):
+    profile = storeEngine.storeProfile(data) if storeEngine.isStore(data) else dataEngine.profileData(data)
+    for title, name in [("Data Summary:", "head"), ("Data Types:", "dtypes"), ("Total Null Values:", "nullCounts")]:
+        st.subheader(title)
+        with perf.stage(f"profile:{name}"):
+            value, seconds = profile.section(name, data)
+        st.write(value)
+        st.caption(f"Computed in {seconds * 1000:.1f} ms")
+    for title, name in [("Min / Max", "minMax"), ("Memory Usage", "memory"), ("Cardinality", "cardinality")]:
+        if st.toggle(f"Show {title}", key=f"profile_{name}"):
+            with perf.stage(f"profile:{name}"):
+                value, seconds = profile.section(name, data)
+            st.write(value)
+            st.caption(f"Computed in {seconds * 1000:.1f} ms")
+#******************************************************************************************************************************
+# Downsampling for line/area charts, applied to the visible year range so narrowing it brings back full resolution.
+# Notes and settings are per thread, figure workers have no session and read the settings captured for their figure.
+chartState = threading.local()
+
+
+def chartNotes():
+    if not hasattr(chartState, "notes"):
+        chartState.notes = []
+    return chartState.notes
+
+
+def downsampleSettings():
+    settings = getattr(chartState, "settings", None)
+    if settings is not None:
+        return settings
+    return (st.session_state.get("downsampleEnabled", False), st.session_state.get("downsampleMaxPoints", 2000),
+            st.session_state.get("downsampleMethod", "LTTB"))
+
+
+def chartFrame(data, y, x='Year'):
+    enabled, maxPoints, method = downsampleSettings()
+    if not enabled:
         return data
+    sampled, dropped = figureEngine.downsampleFrame(data, x, y, maxPoints, method)
+    if dropped:
+        chartNotes().append(f"Showing {len(sampled):,} of {len(data):,} points ({dropped:,} dropped by {method} downsampling).")
+    return sampled
+#******************************************************************************************************************************
+# Figures are memoized on (dataset, page, figure, the widget values it depends on), captions are replayed on a cache hit.
+# A fixed uirevision per chart lets the browser keep zoom and legend state and redraw only what changed.
+# figureJob reads the session on the script thread, the job it returns can run on any thread.
+def figureJob(data, page, name, deps, build):
+    compact = st.session_state.get("compactCharts", True)
+    settings = downsampleSettings()
+    cacheDeps = tuple(deps) + settings + (compact,)
+    built = []
+
+    def buildWithNotes():
+        notes = chartNotes()
+        notes.clear()
+        fig = build()
+        if compact:
+            fig = figureEngine.compactFigure(fig)
+        fig.update_layout(uirevision=f"{page}:{name}")
+        built.append(name)
+        return fig, list(notes)
+
+    def job():
+        chartState.settings = settings
+        try:
+            with perf.stage(f"figure:{name}") as record:
+                fig, notes = figureEngine.cachedFigure(dataEngine.datasetKey(data), page, name, cacheDeps, buildWithNotes)
+                if not built:
+                    record["stage"] = f"figure:{name} (cached)"
+            return fig, notes
+        finally:
+            chartState.settings = None
+
+    return job, figureEngine.figureKey(dataEngine.datasetKey(data), page, name, cacheDeps)
+
+
+def cachedFigure(data, page, name, deps, build):
+    job, _ = figureJob(data, page, name, deps, build)
+    fig, notes = job()
+    for note in notes:
+        st.caption(note)
+    return fig
+#******************************************************************************************************************************
+# Charts go through here so their render time and, when measured, their JSON payload are recorded
+def showChart(fig, name, **kwargs):
+    with perf.stage(f"render:{name}") as record:
+        if st.session_state.get("perfMeasurePayload", False):
+            record["payloadBytes"] = len(fig.to_json())
+        st.plotly_chart(fig, **kwargs)
+#******************************************************************************************************************************
+# Cumulative, rolling, year-over-year and decade series of any numeric column, computed once per dataset and column
+def derivedSeriesPanel(data, page, rangeForYear):
+    if not st.toggle("Show a derived series", key=f"derived_{page}"):
+        return
+    numericColumns = [col for col in data.select_dtypes(include='number').columns if col != 'Year']
+    if not numericColumns:
+        return
+    column = st.selectbox("Column:", numericColumns, key=f"derivedColumn_{page}")
+    kind = st.selectbox("Aggregate:", dataEngine.AGGREGATE_KINDS, key=f"derivedKind_{page}")
+    window = st.slider("Rolling window (years):", 2, 30, 5, key=f"derivedWindow_{page}") if kind == "Rolling Mean" else None
+    valueName = f"{kind} of {column}"
+    with perf.stage("aggregate"):
+        series = dataEngine.aggregate(data, column, kind, window).between(*rangeForYear, valueName)
+
+    def buildDerivedFigure():
+        if kind == "Decade Total":
+            return px.bar(series, x='Decade', y=valueName, title=f'{valueName} per Decade')
+        return px.line(chartFrame(series, valueName), x='Year', y=valueName, title=f'{valueName} over the Years')
+
+    fig = cachedFigure(data, page, "derived", (column, kind, window) + tuple(rangeForYear), buildDerivedFigure)
+    showChart(fig, "derived", use_container_width=True)
+#******************************************************************************************************************************
+# Country pages rank countries instead of drawing every column, a year range sums each country over its years
+COUNTRY_VIEWS = ["Top countries + rest of world", "Bottom countries", "Above a percentile", "All countries"]
+
+
+def countryMapFigure(data, page, countryColumns, yearRange, valueName, yearLabel):
+    # countries are joined to ISO codes once per dataset, a new year only brings new colors
+    detail = "Medium"
+    if geoEngine.GEOMETRY_PATH:
+        detail = st.selectbox("Map detail:", list(geoEngine.MAP_DETAIL), index=1, key=f"mapDetail_{page}")
+    try:
+        with perf.stage("reshape"):
+            codes = geoEngine.countryCodes(data, countryColumns)
+            locations, names, values = geoEngine.mapValues(codes, dataEngine.reshapeCountries(data, countryColumns), *yearRange)
+        fig = cachedFigure(data, page, "figMap", (yearRange, detail), lambda: geoEngine.choropleth(
+            locations, names, values, valueName, f'{valueName} by Country for {yearLabel}', detail))
+    except (ImportError, OSError, ValueError) as exc:
+        st.error(f"Could not draw the map, showing bars instead: {exc}")
+        return None
+    unmatched = codes.unmatched()
+    if unmatched:
+        st.caption(f"Not on the map ({len(unmatched)}): " + ", ".join(map(str, unmatched[:10])) + (", ..." if len(unmatched) > 10 else ""))
+    return fig
+
+
+def countryFigure(data, page, countryColumns, yearData, yearSelect, valueName):
+    yearRange = (yearSelect, yearSelect)
+    if st.toggle("Sum over a year range", key=f"countryRange_{page}"):
+        yearRange = st.slider("Select Year Range", min_value=yearData.bounds()[0], max_value=yearData.bounds()[1],
+                              value=(yearData.bounds()[0], yearSelect), key=f"countryRangeYears_{page}")
+    yearLabel = str(yearRange[0]) if yearRange[0] == yearRange[1] else f"{yearRange[0]}-{yearRange[1]}"
+    if st.radio("Chart:", ["Bar", "Map"], horizontal=True, key=f"countryChart_{page}") == "Map":
+        fig = countryMapFigure(data, page, countryColumns, yearRange, valueName, yearLabel)
+        if fig is not None:
+            return fig
+    view = st.selectbox("Countries shown:", COUNTRY_VIEWS, key=f"countryView_{page}")
+    count = percentile = None
+    if view in COUNTRY_VIEWS[:2]:
+        count = st.number_input("Number of countries:", min_value=1, max_value=len(countryColumns),
+                                value=min(20, len(countryColumns)), key=f"countryCount_{page}")
+    elif view == "Above a percentile":
+        percentile = st.slider("Percentile:", min_value=0, max_value=99, value=90, key=f"countryPercentile_{page}")
+    with perf.stage("reshape"):
+        reshape = dataEngine.reshapeCountries(data, countryColumns)
+        if view == "Top countries + rest of world":
+            ranked = dataEngine.topCountries(reshape, *yearRange, count, valueName)
+        elif view == "Bottom countries":
+            ranked = dataEngine.bottomCountries(reshape, *yearRange, count, valueName)
+        elif view == "Above a percentile":
+            ranked = dataEngine.countriesAbovePercentile(reshape, *yearRange, percentile, valueName)
+        else:
+            ranked = dataEngine.allCountries(reshape, *yearRange, valueName)
+
+    def buildCountryFigure():
+        colors = ['lightgrey' if country == dataEngine.REST_OF_WORLD else px.colors.qualitative.Plotly[0] for country in ranked['Country']]
+        figCount = go.Figure()
+        figCount.add_trace(go.Bar(x=ranked['Country'], y=ranked[valueName], name=yearLabel, marker_color=colors,
+                                  customdata=ranked['Share (%)'], hovertemplate="%{x}: %{y:,.2f} (%{customdata:.1f}% of total)<extra></extra>"))
+        figCount.update_layout(xaxis_title='Country', yaxis_title=valueName, title=f'{valueName} Country-wise for {yearLabel}')
+        return figCount
+
+    return cachedFigure(data, page, "figCount", (yearRange, view, count, percentile), buildCountryFigure)
 #****************************************************************************************************************************** 
 # Configuration
 st.set_page_config(page_title="Carbon Emission Data Analysis", layout="wide")
@@ -61,479 +347,417 @@ def welcomPage():
     if st.button("Get Started"):
         st.success("Great! Let's get started with the analysis.")
 #******************************************************************************************************************************
-# Cement Carbon Emission
-def cementEmissionPage():
-    st.title("Cement Carbon Emission Analysis")
-    
-    # Upload CSV file
-    pathFile = st.file_uploader("Upload CSV file for Cement Carbon Emission", type=["csv"])
-    
-    if pathFile is not None:
-        data = loaderFunction(pathFile)
-        
-        # Display uploaded data
-        st.success("File successfully uploaded and loaded!")
-        st.subheader("Data Summary:")
-        st.write(data.head())  
-        st.subheader("Data Types:")
-        st.write(data.dtypes) 
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())  
-        
-        # Handle null values
-        nullHandlingOption = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        if nullHandlingOption != "Keep Null":
-            data = caterNullVals(data, nullHandlingOption)
-            st.success(f"Null values Handled Successfully: {nullHandlingOption}")
-        
-        # Plot 1: Line Plot for GCB over the Years
-        fig1 = px.line(data, x='Year', y='GCB', title='Cement Carbon Emission (Global Carbon Emission) over the Years')
-        st.plotly_chart(fig1, use_container_width=True)
-        st.markdown("**Storytelling Question 1:** How has GCB emissions changed over the years?")
-        
-        # Plot 2: Scatter Plot for Cao and Huang
-        fig2 = px.scatter(data, x='Cao', y='Huang', title='Scatter Plot: Cao (Calcium-based sorbents) vs Huang')
-        st.plotly_chart(fig2, use_container_width=True)
-        st.markdown("**Storytelling Question 2:** Is there a correlation between Cao and Huang emissions?")
-        
-        # Plot 3: Bar Chart for Total Emissions in a Specific Year
-        yearSelect = st.slider("Select a Year:", min_value=int(data['Year'].min()), max_value=int(data['Year'].max()))
-        dataSelect = data[data['Year'] == yearSelect]
-        fig3 = px.bar(dataSelect, x='Year', y=['GCB', 'Cao', 'Huang'], barmode='group',
-                     title=f'Emission Breakdown for the Year {yearSelect}')
-        st.plotly_chart(fig3, use_container_width=True)
-        st.markdown("**Storytelling Question 3:** How does the emission composition change in a specific year?")
-        
-        # Plot 4: Box Plot for GCB Emissions
-        fig4 = px.box(data, y='GCB', title='Box Plot: Distribution of GCB Emissions')
-        st.plotly_chart(fig4, use_container_width=True)
-        st.markdown("**Storytelling Question 4:** What is the distribution of GCB emissions?")
-        
-        # Plot 5: Area Chart for Cumulative Cao Emissions over the Years
-        data['Cumulative_Cao'] = data['Cao'].cumsum()
-        fig5 = px.area(data, x='Year', y='Cumulative_Cao', title='Cumulative Cao Emissions over the Years')
-        st.plotly_chart(fig5, use_container_width=True)
-        st.markdown("**Storytelling Question 5:** How does Cao emissions accumulate over the years?")
-        
-#******************************************************************************************************************************    
-# Global Carbon Budget
-def globalCarbonBudgetPage():
-    st.title("Global Carbon Budget Analysis")
-    
-    # Upload CSV file
-    pathFile = st.file_uploader("Upload CSV file for Global Carbon Budget", type=["csv"])
-    
-    if pathFile is not None:
-        data = loaderFunction(pathFile)
-        
-        # Display uploaded data
-        st.success("File successfully uploaded and loaded!")
-        st.subheader("Data Summary:")
-        st.write(data.head())  
-        st.subheader("Data Types:")
-        st.write(data.dtypes) 
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())  
-        
-        # Handle null values
-        nullHandlingOption = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        if nullHandlingOption != "Keep Null":
-            data = caterNullVals(data, nullHandlingOption)
-            st.success(f"Null values Handled Successfully: {nullHandlingOption}")
-        st.write("Budget imbalance refers to a situation where there is a disparity between a government's revenue and its expenditures within a specified period, typically a fiscal year. ")   
-#******************************************************************************************************************************
-        rangeForYear = st.slider("Select Year Range:", min_value=int(data['Year'].min()), 
-                               max_value=int(data['Year'].max()), value=(int(data['Year'].min()), int(data['Year'].max())))
-        
-#******************************************************************************************************************************
-        fig1 = px.line(data[(data['Year'] >= rangeForYear[0]) & (data['Year'] <= rangeForYear[1])], 
-                       x='Year', y='fossil emissions excluding carbonation',
-                       title='Fossil Emissions (excluding carbonation) over the Years',
-                       labels={'fossil emissions excluding carbonation': 'Fossil Emissions'})
-        st.plotly_chart(fig1, use_container_width=True)
-        st.markdown("**Storytelling Question 1:** How have fossil emissions (excluding carbonation) changed over the selected years?")
-        
+# Page pipeline
+# Every analysis page is declared below as a PageSpec: its dataset, the columns it needs and its steps (year controls,
+# charts, country rankings, derived series). runPage runs the shared pipeline, load -> profile -> null handling ->
+# steps, so every page gets the same cached and indexed hot path. Frames are only sliced when a chart is rebuilt.
+# With concurrent figures on, the charts of a page are built on the figure pool while the script thread goes on
+# with the other steps, each chart is drawn into the slot it was given once its figure is back. tracemalloc peaks
+# are process wide, so while peak memory is tracked the charts are built one after another to keep them per stage.
+class PageView:
+    def __init__(self, data, chartPage):
+        self.data = data
+        self.chartPage = chartPage
+        self.values = {}
+        self.frames = {}
+        self.yearIndex = None
+        # figure workers share the view, a slice is built once however many charts ask for it at the same time
+        self.lock = threading.RLock()
+
+    def yearData(self):
+        with self.lock:
+            if self.yearIndex is None:
+                with perf.stage("filter"):
+                    self.yearIndex = dataEngine.indexByYear(self.data)
+            return self.yearIndex
+
+    def rangeForYear(self):
+        return self.values.get("rangeForYear", self.yearData().bounds())
+
+    def frame(self, name, compute):
+        # slices are built the first time a chart on this rerun asks for them, cache hits never pay for them
+        with self.lock:
+            if name not in self.frames:
+                with perf.stage("filter"):
+                    self.frames[name] = compute()
+            return self.frames[name]
+
+    def inRange(self):
+        return self.frame("inRange", lambda: self.yearData().between(*self.rangeForYear()))
+
+    def selected(self):
+        return self.frame("selected", lambda: self.yearData().at(self.values["yearSelect"]))
+
+    def deps(self, names):
+        return tuple(self.values[name] for name in names)
+
+
+class YearSlider:
+    def __init__(self, label, latest=False):
+        self.label = label
+        self.latest = latest
+
+    def run(self, view):
+        low, high = view.yearData().bounds()
+        view.values["yearSelect"] = st.slider(self.label, min_value=low, max_value=high, value=high if self.latest else None)
+
+
+class YearRangeSlider:
+    def run(self, view):
+        bounds = view.yearData().bounds()
+        view.values["rangeForYear"] = st.slider("Select Year Range:", min_value=bounds[0], max_value=bounds[1], value=bounds)
+
+
+class ColumnPicker:
+    def __init__(self, name, label, columns):
+        self.name = name
+        self.label = label
+        self.columns = columns
+
+    def run(self, view):
+        options = self.columns(view.data)
+        view.values[self.name] = tuple(st.multiselect(self.label, options, default=options))
+
+
+class Chart:
+    def __init__(self, name, build, question=None, deps=(), **chartArgs):
+        self.name = name
+        self.build = build
+        self.question = question
+        self.deps = deps
+        self.chartArgs = chartArgs
+
+    def run(self, view):
+        fig = cachedFigure(view.data, view.chartPage, self.name, view.deps(self.deps), lambda: self.build(view))
+        showChart(fig, self.name, **self.chartArgs)
+        if self.question:
+            st.markdown(self.question)
+
+    def submit(self, view):
+        slot = st.container()
+        if self.question:
+            st.markdown(self.question)
+        job, key = figureJob(view.data, view.chartPage, self.name, view.deps(self.deps), lambda: self.build(view))
+        return (self, slot) + figureEngine.submitFigure(job, key)
+
+    def show(self, slot, future, deadline):
+        result, error = figureEngine.collectFigure(future, deadline)
+        with slot:
+            if error is not None:
+                st.error(f"Could not draw {self.name}: {error}")
+                return
+            fig, notes = result
+            for note in notes:
+                st.caption(note)
+            showChart(fig, self.name, **self.chartArgs)
+
+
+class CountryChart:
+    def __init__(self, valueName):
+        self.valueName = valueName
+
+    def run(self, view):
+        countryColumns = view.data.columns[1:]
+        fig = countryFigure(view.data, view.chartPage, countryColumns, view.yearData(), view.values["yearSelect"], self.valueName)
+        showChart(fig, "figCount")
+
+
+class DerivedSeries:
+    def run(self, view):
+        derivedSeriesPanel(view.data, view.chartPage, view.rangeForYear())
+
+
+class Text:
+    def __init__(self, text, kind="write"):
+        self.text = text
+        self.kind = kind
+
+    def run(self, view):
+        getattr(st, self.kind)(self.text)
+
+
+class NullCounts:
+    def run(self, view):
+        st.write("Data After Removing Nulls")
+        st.write(dataEngine.nullStats(view.data).nullCounts)
+
+
+class PageSpec:
+    def __init__(self, name, title, columns=None, chartPage=None, intro=None, steps=()):
+        self.name = name
+        self.title = title
+        self.columns = columns
+        self.chartPage = chartPage or name
+        self.intro = intro
+        self.steps = steps
+
+
+def yearlyFrame(store):
+    # out of core the page works on one row per year, reduced batch by batch from the mapped file
+    how = st.session_state.get("outOfCoreReduction", "Mean")
+    with perf.stage("reshape:yearly"):
+        yearly = storeEngine.yearlyFrame(store, how)
+    st.caption(f"Out of core: {len(store):,} rows stay on disk, the charts use {len(yearly):,} yearly rows "
+               f"({how.lower()} of the rows of each year).")
+    return yearly
+
+
+def runPage(spec):
+    st.title(spec.title)
+    data = datasetPicker(spec.name, f"Upload CSV file for {spec.name}")
+    if data is None:
+        return
+    st.success("File successfully uploaded and loaded!")
+    if spec.intro:
+        st.write(spec.intro)
+    profilePanel(data)
+    if storeEngine.isStore(data):
+        data = yearlyFrame(data)
+    nullHandlingOption = st.selectbox("How to handle null values:", dataEngine.NULL_HANDLING_OPTIONS)
+    if nullHandlingOption != "Keep Null":
+        data = caterNullVals(data, nullHandlingOption)
+        st.success(f"Null values handled successfully: {nullHandlingOption}")
+    view = PageView(data, spec.chartPage)
+    if perf.trackMemory or not st.session_state.get("concurrentFigures", True):
+        for step in spec.steps:
+            step.run(view)
+        return
+    pending = []
+    for step in spec.steps:
+        if isinstance(step, Chart):
+            pending.append(step.submit(view))
+        else:
+            step.run(view)
+    for chart, slot, future, deadline in pending:
+        chart.show(slot, future, deadline)
 #******************************************************************************************************************************
-        fig2 = px.area(data[(data['Year'] >= rangeForYear[0]) & (data['Year'] <= rangeForYear[1])], 
-                       x='Year', y=['ocean sink', 'land sink', 'cement carbonation sink'],
-                       title='Distribution of Carbon Sinks over the Years', 
-                       labels={'value': 'Carbon Sink'})
-        st.plotly_chart(fig2, use_container_width=True)
-        st.markdown("**Storytelling Question 2:** What is the contribution of different sinks to the carbon budget over the selected years?")
-        
- #******************************************************************************************************************************
-        fig3 = px.bar(data[(data['Year'] >= rangeForYear[0]) & (data['Year'] <= rangeForYear[1])], 
-                      x='Year', y='budget imbalance', color='budget imbalance',
-                      title='Budget Imbalance over the Years', 
-                      labels={'budget imbalance': 'Budget Imbalance'})
-        st.plotly_chart(fig3, use_container_width=True)
-        st.markdown("**Storytelling Question 3:** How does the budget imbalance vary from year to year in the selected range?")
+# Cement Carbon Emission
+CEMENT_PAGE = PageSpec("Cement Carbon Emission", "Cement Carbon Emission Analysis", chartPage="Cement",
+                       columns=['Year', 'GCB', 'Cao', 'Huang'], steps=[
+    # Plot 1: Line Plot for GCB over the Years
+    Chart("fig1", lambda view: px.line(chartFrame(view.data, 'GCB'), x='Year', y='GCB', title='Cement Carbon Emission (Global Carbon Emission) over the Years'),
+          "**Storytelling Question 1:** How has GCB emissions changed over the years?", use_container_width=True),
+    # Plot 2: Scatter Plot for Cao and Huang
+    Chart("fig2", lambda view: px.scatter(view.data, x='Cao', y='Huang', title='Scatter Plot: Cao (Calcium-based sorbents) vs Huang'),
+          "**Storytelling Question 2:** Is there a correlation between Cao and Huang emissions?", use_container_width=True),
+    # Plot 3: Bar Chart for Total Emissions in a Specific Year
+    YearSlider("Select a Year:"),
+    Chart("fig3", lambda view: px.bar(view.selected(), x='Year', y=['GCB', 'Cao', 'Huang'], barmode='group',
+                                      title=f'Emission Breakdown for the Year {view.values["yearSelect"]}'),
+          "**Storytelling Question 3:** How does the emission composition change in a specific year?", deps=("yearSelect",), use_container_width=True),
+    # Plot 4: Box Plot for GCB Emissions
+    Chart("fig4", lambda view: px.box(view.data, y='GCB', title='Box Plot: Distribution of GCB Emissions'),
+          "**Storytelling Question 4:** What is the distribution of GCB emissions?", use_container_width=True),
+    # Plot 5: Area Chart for Cumulative Cao Emissions over the Years
+    Chart("fig5", lambda view: px.area(chartFrame(dataEngine.aggregate(view.data, 'Cao', "Cumulative").frame('Cumulative_Cao'), 'Cumulative_Cao'),
+                                       x='Year', y='Cumulative_Cao', title='Cumulative Cao Emissions over the Years'),
+          "**Storytelling Question 5:** How does Cao emissions accumulate over the years?", use_container_width=True),
+    DerivedSeries(),
+])
+#******************************************************************************************************************************
+# Global Carbon Budget and Historical Budget share their fossil and imbalance charts
+def fossilLineChart():
+    return Chart("fig1", lambda view: px.line(chartFrame(view.inRange(), 'fossil emissions excluding carbonation'),
+                                              x='Year', y='fossil emissions excluding carbonation',
+                                              title='Fossil Emissions (excluding carbonation) over the Years',
+                                              labels={'fossil emissions excluding carbonation': 'Fossil Emissions'}),
+                 "**Storytelling Question 1:** How have fossil emissions (excluding carbonation) changed over the selected years?",
+                 deps=("rangeForYear",), use_container_width=True)
+
+
+def imbalanceBarChart():
+    return Chart("fig3", lambda view: px.bar(view.inRange(), x='Year', y='budget imbalance', color='budget imbalance',
+                                             title='Budget Imbalance over the Years',
+                                             labels={'budget imbalance': 'Budget Imbalance'}),
+                 "**Storytelling Question 3:** How does the budget imbalance vary from year to year in the selected range?",
+                 deps=("rangeForYear",), use_container_width=True)
+
+
+GLOBAL_BUDGET_PAGE = PageSpec("Global Carbon Budget", "Global Carbon Budget Analysis",
+                              columns=['Year', 'fossil emissions excluding carbonation', 'ocean sink', 'land sink',
+                                       'cement carbonation sink', 'budget imbalance'], steps=[
+    Text("Budget imbalance refers to a situation where there is a disparity between a government's revenue and its expenditures within a specified period, typically a fiscal year. "),
+    YearRangeSlider(),
+    fossilLineChart(),
+    Chart("fig2", lambda view: px.area(chartFrame(view.inRange(), ['ocean sink', 'land sink', 'cement carbonation sink']),
+                                       x='Year', y=['ocean sink', 'land sink', 'cement carbonation sink'],
+                                       title='Distribution of Carbon Sinks over the Years',
+                                       labels={'value': 'Carbon Sink'}),
+          "**Storytelling Question 2:** What is the contribution of different sinks to the carbon budget over the selected years?",
+          deps=("rangeForYear",), use_container_width=True),
+    imbalanceBarChart(),
+    DerivedSeries(),
+])
 #******************************************************************************************************************************
 #  Historical Budget
-def historicalBudgetPage():
-    st.title("Historical Budget Analysis")
-    
-    # Upload CSV file
-    pathFile = st.file_uploader("Upload CSV file for Historical Budget", type=["csv"])
-    
-    if pathFile is not None:
-        data = loaderFunction(pathFile)
-        
-        # Display uploaded data
-        st.success("File successfully uploaded and loaded!")
-        st.subheader("Data Summary:")
-        st.write(data.head())  
-        st.subheader("Data Types:")
-        st.write(data.dtypes) 
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())  
-        
-        # Handle null values
-        nullHandlingOption = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        if nullHandlingOption != "Keep Null":
-            data = caterNullVals(data, nullHandlingOption)
-            st.success(f"Null values Handled Successfully: {nullHandlingOption}")
-        
-#******************************************************************************************************************************
-        rangeForYear = st.slider("Select Year Range:", min_value=int(data['Year'].min()), 
-                               max_value=int(data['Year'].max()), value=(int(data['Year'].min()), int(data['Year'].max())))
-        
-#******************************************************************************************************************************
-        fig1 = px.line(data[(data['Year'] >= rangeForYear[0]) & (data['Year'] <= rangeForYear[1])], 
-                       x='Year', y='fossil emissions excluding carbonation',
-                       title='Fossil Emissions (excluding carbonation) over the Years',
-                       labels={'fossil emissions excluding carbonation': 'Fossil Emissions'})
-        st.plotly_chart(fig1, use_container_width=True)
-        st.markdown("**Storytelling Question 1:** How have fossil emissions (excluding carbonation) changed over the selected years?")
-#******************************************************************************************************************************
-        fig2 = px.area(data[(data['Year'] >= rangeForYear[0]) & (data['Year'] <= rangeForYear[1])], 
-                       x='Year', y=['atmospheric growth', 'ocean sink', 'land sink'],
-                       title='Components of Carbon Budget over the Years', 
-                       labels={'value': 'Carbon Budget Component'})
-        st.plotly_chart(fig2, use_container_width=True)
-        st.markdown("**Storytelling Question 2:** What are the contributions of different components to the carbon budget over the selected years?")
-#******************************************************************************************************************************
-        fig3 = px.bar(data[(data['Year'] >= rangeForYear[0]) & (data['Year'] <= rangeForYear[1])], 
-                      x='Year', y='budget imbalance', color='budget imbalance',
-                      title='Budget Imbalance over the Years', 
-                      labels={'budget imbalance': 'Budget Imbalance'})
-        st.plotly_chart(fig3, use_container_width=True)
-        st.markdown("**Storytelling Question 3:** How does the budget imbalance vary from year to year in the selected range?")
+HISTORICAL_BUDGET_PAGE = PageSpec("Historical Budget", "Historical Budget Analysis",
+                                  columns=['Year', 'fossil emissions excluding carbonation', 'atmospheric growth', 'ocean sink',
+                                           'land sink', 'budget imbalance'], steps=[
+    YearRangeSlider(),
+    fossilLineChart(),
+    Chart("fig2", lambda view: px.area(chartFrame(view.inRange(), ['atmospheric growth', 'ocean sink', 'land sink']),
+                                       x='Year', y=['atmospheric growth', 'ocean sink', 'land sink'],
+                                       title='Components of Carbon Budget over the Years',
+                                       labels={'value': 'Carbon Budget Component'}),
+          "**Storytelling Question 2:** What are the contributions of different components to the carbon budget over the selected years?",
+          deps=("rangeForYear",), use_container_width=True),
+    imbalanceBarChart(),
+    DerivedSeries(),
+])
 #******************************************************************************************************************************
 #  Land Use Change Emission
-def landUseChangeEmissionPage():
-    st.title("Land Use Change Emission Analysis")
-    
-    # Upload CSV file
-    pathFile = st.file_uploader("Upload CSV file for Land Use Change Emission", type=["csv"])
-    
-    if pathFile is not None:
-        data = loaderFunction(pathFile)
-        
-        # Display uploaded data
-        st.success("File successfully uploaded and loaded!")
-        st.subheader("Data Summary:")
-        st.write(data.head())  
-        st.subheader("Data Types:")
-        st.write(data.dtypes) 
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())  
-        
-        # Handle null values
-        handleNullValueOptions = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        if handleNullValueOptions != "Keep Null":
-            data = caterNullVals(data, handleNullValueOptions)
-            st.success(f"Null values handled successfully: {handleNullValueOptions}")    
-#******************************************************************************************************************************
-        rangeForYear = st.slider("Select Year Range:", min_value=int(data['Year'].min()), 
-                               max_value=int(data['Year'].max()), value=(int(data['Year'].min()), int(data['Year'].max())))
-        
-#******************************************************************************************************************************
-        transSelect = st.multiselect("Select Land Use Change Transitions:", list(data.columns[2:7]), default=list(data.columns[2:7]))
-#******************************************************************************************************************************
-        dataFiltereddd = data[(data['Year'] >= rangeForYear[0]) & (data['Year'] <= rangeForYear[1])]
-        if transSelect:
-            dataFiltereddd = dataFiltereddd[transSelect + ['Year']]
-#******************************************************************************************************************************
-        fig1 = px.line(dataFiltereddd, x='Year', y=transSelect,
-                       color_discrete_sequence=px.colors.qualitative.Set1,
-                       title='Net Deforestation over the Years', 
-                       labels={'value': 'Net Deforestation'})
-        st.plotly_chart(fig1, use_container_width=True)
-        st.markdown("**Storytelling Question 1:** How does net deforestation vary over the selected years and transitions?")
-#******************************************************************************************************************************
-        fig2 = px.bar(dataFiltereddd, x='Year', y='forest regrowth (total)',
-                      color='forest regrowth (total)',
-                      title='Total Forest Regrowth over the Years', 
-                      labels={'forest regrowth (total)': 'Total Forest Regrowth'})
-        st.plotly_chart(fig2, use_container_width=True)
-        st.markdown("**Storytelling Question 2:** What is the pattern of total forest regrowth over the selected years?")
-#******************************************************************************************************************************
-        fig3 = px.scatter(dataFiltereddd, x='deforestation (total)', y='forest regrowth (total)',
-                          color='Year', size='wood harvest & other forest management',
-                          title='Net Deforestation vs. Forest Regrowth', 
-                          labels={'Net deforestation (total)': 'Net Deforestation', 'forest regrowth (total)': 'Forest Regrowth'})
-        st.plotly_chart(fig3, use_container_width=True)
-        st.markdown("**Storytelling Question 3:** How is the relationship between net deforestation and forest regrowth?")
-#******************************************************************************************************************************
-        fig4 = px.area(dataFiltereddd, x='Year', y=transSelect,
-                       title='Area Chart for Land Use Change Transitions Over the Years', 
-                       labels={'value': 'Land Use Change'})
-        st.plotly_chart(fig4, use_container_width=True)
-        st.markdown("**Storytelling Question 4:** How do different land use change transitions evolve over the years?")
-#******************************************************************************************************************************        
-        # fig5 = px.area(dataFiltereddd, x='Year', y=transSelect,
-        #                title='Stacked Area Chart for Land Use Change Transitions Over the Years', 
-        #                labels={'value': 'Land Use Change'}, 
-        #                color_discrete_sequence=px.colors.qualitative.Set2)
-        # st.plotly_chart(fig5, use_container_width=True)
-        # st.markdown("**Question 5:** Explore the stacked area chart to observe the contributions of different land use change transitions over the years.")
-        
-#******************************************************************************************************************************
-#  Ocean Sink
-def oceanSinkPage():
-    st.title("Ocean Sink Analysis")
-    #  Ocean Sink
-    pathFile = st.file_uploader("Upload CSV file for Ocean Sink", type=["csv"])
-    if pathFile is not None:
-        data = loaderFunction(pathFile)
-        st.success("File successfully uploaded and loaded!")
-        st.write("The ocean acts as a “carbon sink” and absorbs about 31% of the CO2 emissions released into the atmosphere according to a study published by NOAA and international partners in Science.")
-        st.subheader("Data Summary:")
-        st.write(data.head())  
-        st.subheader("Data Types:")
-        st.write(data.dtypes) 
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())  
-        nullHandlingOption = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        
-        if nullHandlingOption != "Keep Null":
-            data =  caterNullVals(data, nullHandlingOption)
-        st.success(f"Null values Handled Successfuly : {nullHandlingOption}")
-        st.write("Data After Removing Nulls") 
-        st.write(data.isnull().sum())         
-#******************************************************************************************************************************
-#  Terrestrial Sink
-def terrestrialSinkPage():
-    st.title("Terrestrial Sink Analysis")
-
-    # Terrestrial Sink
-    pathFile = st.file_uploader("Upload CSV file for Terrestrial Sink", type=["csv"])
-    
-    if pathFile is not None:
-        data = pd.read_csv(pathFile)
-        st.success("File successfully uploaded and loaded!")
-        st.write("A terrestrial sink, in this context, refers to the capacity of terrestrial ecosystems such as forests, grasslands, and soils to absorb and store carbon dioxide (CO2) from the atmosphere through processes like photosynthesis and biomass accumulation. ")
-        st.subheader("Data Summary:")
-        st.write(data.head())  
-        
-        st.subheader("Data Types:")
-        st.write(data.dtypes)  
-        
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())  
-
-        nullHandlingOption = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        
-        if nullHandlingOption != "Keep Null":
-            data = caterNullVals(data, nullHandlingOption)
-        st.success(f"Null values Handled Successfully: {nullHandlingOption}")
-#******************************************************************************************************************************
-#  Consumption Emission
-def consumptionEmissionPage():
-    st.title("Consumption Emission Analysis")
-    #  Consumption Emission
-    pathFile = st.file_uploader("Upload CSV file for Consumption Emission", type=["csv"])
-    if pathFile is not None:
-        data = loaderFunction(pathFile)
-        st.success("File successfully uploaded and loaded!")
-        st.subheader("Data Summary:")
-        st.write(data.head())  
-        st.subheader("Data Types:")
-        st.write(data.dtypes) 
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())  
-        nullHandlingOption = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        
-        if nullHandlingOption != "Keep Null":
-            data =  caterNullVals(data, nullHandlingOption)
-        st.success(f"Null values Handled Successfuly : {nullHandlingOption}") 
-        st.subheader("Consumption Emission Country-wise:")
-        
-#******************************************************************************************************************************
-        countryColumns = data.columns[1:]
-#******************************************************************************************************************************
-        meltedCols = pd.melt(data, id_vars=['Year'], value_vars=countryColumns, var_name='Country', value_name='Consumption Emission')
-#******************************************************************************************************************************
-        yearSelect = st.slider("Select Year", min_value=int(data['Year'].min()), max_value=int(data['Year'].max()), value=int(data['Year'].max()))
-#******************************************************************************************************************************
-        yearlySelectedData = meltedCols[meltedCols['Year'] == yearSelect]
-#******************************************************************************************************************************
-        figCount = go.Figure()
-
-        figCount.add_trace(go.Bar(x=yearlySelectedData['Country'], y=yearlySelectedData['Consumption Emission'], name=str(yearSelect)))
-
-        figCount.update_layout(xaxis_title='Country', yaxis_title='Consumption Emission', title=f'Consumption Emission Country-wise for {yearSelect}')
-        
-        st.plotly_chart(figCount)
-#******************************************************************************************************************************
-#  Emission Transfer
-def emissionTransferPage():
-    st.title("Emission Transfer Analysis")
-    #  Emission Transfer
-    pathFile = st.file_uploader("Upload CSV file for Emission Transfer", type=["csv"])
-    if pathFile is not None:
-        data = loaderFunction(pathFile)
-        st.success("File successfully uploaded and loaded!")
-        st.subheader("Data Summary:")
-        st.write(data.head())  
-        st.subheader("Data Types:")
-        st.write(data.dtypes) 
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())  
-        nullHandlingOption = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        
-        if nullHandlingOption != "Keep Null":
-            data =  caterNullVals(data, nullHandlingOption)
-        st.success(f"Null values Handled Successfuly : {nullHandlingOption}")
-#******************************************************************************************************************************
-        countryColumns = data.columns[1:]
-        meltedCols = pd.melt(data, id_vars=['Year'], value_vars=countryColumns, var_name='Country', value_name='Emission Transfer')
- #******************************************************************************************************************************
-        yearSelect = st.slider("Select Year", min_value=int(data['Year'].min()), max_value=int(data['Year'].max()), value=int(data['Year'].max()))
-#******************************************************************************************************************************
-        yearlySelectedData = meltedCols[meltedCols['Year'] == yearSelect]
-#******************************************************************************************************************************
-        figCount = go.Figure()
-
-        figCount.add_trace(go.Bar(x=yearlySelectedData['Country'], y=yearlySelectedData['Emission Transfer'], name=str(yearSelect)))
-
-        figCount.update_layout(xaxis_title='Country', yaxis_title='Emission Transfer', title=f'Emission Transfer Country-wise for {yearSelect}')
-        
-        st.plotly_chart(figCount)
-#******************************************************************************************************************************
-#  Territorial Emission
-def territorialEmissionPage():
-    st.title("Territorial Emission Analysis")
-    #  Territorial Emission
-    pathFile = st.file_uploader("Upload CSV file for Territorial Emission", type=["csv"])
-    if pathFile is not None:
-        data = loaderFunction(pathFile)
-        st.success("File successfully uploaded and loaded!")
-        st.subheader("Data Summary:")
-        st.write(data.head())  
-        st.subheader("Data Types:")
-        st.write(data.dtypes) 
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())  
-        nullHandlingOption = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        
-        if nullHandlingOption != "Keep Null":
-            data =  caterNullVals(data, nullHandlingOption)
-        st.success(f"Null values Handled Successfuly : {nullHandlingOption}")
-#******************************************************************************************************************************
-        countryColumns = data.columns[1:]
-#******************************************************************************************************************************
-        meltedCols = pd.melt(data, id_vars=['Year'], value_vars=countryColumns, var_name='Country', value_name='Emission Transfer')
-#******************************************************************************************************************************
-        yearSelect = st.slider("Select Year", min_value=int(data['Year'].min()), max_value=int(data['Year'].max()), value=int(data['Year'].max()))
-#******************************************************************************************************************************
-        yearlySelectedData = meltedCols[meltedCols['Year'] == yearSelect]
-#******************************************************************************************************************************
-        figCount = go.Figure()
-#******************************************************************************************************************************
-        figCount.add_trace(go.Bar(x=yearlySelectedData['Country'], y=yearlySelectedData['Emission Transfer'], name=str(yearSelect)))
-#******************************************************************************************************************************
-        figCount.update_layout(xaxis_title='Country', yaxis_title='Emission Transfer', title=f'Emission Transfer Country-wise for {yearSelect}')
-        
-        st.plotly_chart(figCount)
-#******************************************************************************************************************************
-def fossilEmissionPage():
-    st.title("Fossil Emission Analysis")
-    #  Territorial Emission
-    pathFile = st.file_uploader("Upload CSV file for Fossil Emission", type=["csv"])
-    if pathFile is not None:
-        data = loaderFunction(pathFile)
-        st.success("File successfully uploaded and loaded!")
-        st.subheader("Data Summary:")
-        st.write(data.head())  
-        st.subheader("Data Types:")
-        st.write(data.dtypes) 
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())  
-        nullHandlingOption = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        
-        if nullHandlingOption != "Keep Null":
-            data =  caterNullVals(data, nullHandlingOption)
-        st.success(f"Null values Handled Successfuly : {nullHandlingOption}")
-#******************************************************************************************************************************
-def fossilEmissionPage():
-    st.title("Fossil Emission Analysis")
-    
-    # Territorial Emission
-    pathFile = st.file_uploader("Upload CSV file for Fossil Emission", type=["csv"])
-    
-    if pathFile is not None:
-        data = pd.read_csv(pathFile)
-        st.success("File successfully uploaded and loaded!")
-        
-        st.subheader("Data Summary:")
-        st.write(data.head())
-        
-        st.subheader("Data Types:")
-        st.write(data.dtypes)
-        
-        st.subheader("Total Null Values:")
-        st.write(data.isnull().sum())
-        
-        nullHandlingOption = st.selectbox("How to handle null values:", ["Remove Null", "Impute by Mode", "Keep Null"])
-        
-        if nullHandlingOption != "Keep Null":
-#******************************************************************************************************************************
-            data = caterNullVals(data, nullHandlingOption)
-        
-        st.success(f"Null values handled successfully: {nullHandlingOption}")
-#******************************************************************************************************************************
-        st.subheader("Fossil Emissions Over the Years:")
-#******************************************************************************************************************************
-        figFossilEmission = px.line(data, x='Year', y=['fossil.emissions.excluding.carbonation', 'Coal', 'Oil', 'Gas', 'Cement.emission', 'Flaring', 'Other'],
-                                       title='Fossil Emissions Over the Years',
-                                       labels={'value': 'Emissions', 'Year': 'Year'},
-                                       line_shape='linear',
-                                       template='plotly_dark')
-
-        st.plotly_chart(figFossilEmission)
+def landUseFrame(view):
+    transSelect = list(view.values["transSelect"])
+    if not transSelect:
+        return view.inRange()
+    return view.frame("transitions", lambda: view.inRange()[transSelect + ['Year']])
+
+
+LAND_USE_DEPS = ("rangeForYear", "transSelect")
+LAND_USE_PAGE = PageSpec("Land Use Change Emission", "Land Use Change Emission Analysis", chartPage="Land Use Change",
+                         columns=['Year', 'deforestation (total)', 'forest regrowth (total)',
+                                  'wood harvest & other forest management'], steps=[
+    YearRangeSlider(),
+    ColumnPicker("transSelect", "Select Land Use Change Transitions:", lambda data: list(data.columns[2:7])),
+    Chart("fig1", lambda view: px.line(chartFrame(landUseFrame(view), list(view.values["transSelect"])), x='Year', y=list(view.values["transSelect"]),
+                                       color_discrete_sequence=px.colors.qualitative.Set1,
+                                       title='Net Deforestation over the Years',
+                                       labels={'value': 'Net Deforestation'}),
+          "**Storytelling Question 1:** How does net deforestation vary over the selected years and transitions?",
+          deps=LAND_USE_DEPS, use_container_width=True),
+    Chart("fig2", lambda view: px.bar(landUseFrame(view), x='Year', y='forest regrowth (total)',
+                                      color='forest regrowth (total)',
+                                      title='Total Forest Regrowth over the Years',
+                                      labels={'forest regrowth (total)': 'Total Forest Regrowth'}),
+          "**Storytelling Question 2:** What is the pattern of total forest regrowth over the selected years?",
+          deps=LAND_USE_DEPS, use_container_width=True),
+    Chart("fig3", lambda view: px.scatter(landUseFrame(view), x='deforestation (total)', y='forest regrowth (total)',
+                                          color='Year', size='wood harvest & other forest management',
+                                          title='Net Deforestation vs. Forest Regrowth',
+                                          labels={'Net deforestation (total)': 'Net Deforestation', 'forest regrowth (total)': 'Forest Regrowth'}),
+          "**Storytelling Question 3:** How is the relationship between net deforestation and forest regrowth?",
+          deps=LAND_USE_DEPS, use_container_width=True),
+    Chart("fig4", lambda view: px.area(chartFrame(landUseFrame(view), list(view.values["transSelect"])), x='Year', y=list(view.values["transSelect"]),
+                                       title='Area Chart for Land Use Change Transitions Over the Years',
+                                       labels={'value': 'Land Use Change'}),
+          "**Storytelling Question 4:** How do different land use change transitions evolve over the years?",
+          deps=LAND_USE_DEPS, use_container_width=True),
+    DerivedSeries(),
+])
+#******************************************************************************************************************************
+#  Ocean Sink and Terrestrial Sink only profile and clean their data
+OCEAN_SINK_PAGE = PageSpec("Ocean Sink", "Ocean Sink Analysis", steps=[NullCounts()],
+                           intro="The ocean acts as a “carbon sink” and absorbs about 31% of the CO2 emissions released into the atmosphere according to a study published by NOAA and international partners in Science.")
+TERRESTRIAL_SINK_PAGE = PageSpec("Terrestrial Sink", "Terrestrial Sink Analysis",
+                                 intro="A terrestrial sink, in this context, refers to the capacity of terrestrial ecosystems such as forests, grasslands, and soils to absorb and store carbon dioxide (CO2) from the atmosphere through processes like photosynthesis and biomass accumulation. ")
+#******************************************************************************************************************************
+#  Consumption Emission, Emission Transfer and Territorial Emission rank the countries of one year or a year range
+CONSUMPTION_PAGE = PageSpec("Consumption Emission", "Consumption Emission Analysis", steps=[
+    Text("Consumption Emission Country-wise:", "subheader"), YearSlider("Select Year", latest=True), CountryChart('Consumption Emission')])
+TRANSFER_PAGE = PageSpec("Emission Transfer", "Emission Transfer Analysis", steps=[
+    YearSlider("Select Year", latest=True), CountryChart('Emission Transfer')])
+TERRITORIAL_PAGE = PageSpec("Territorial Emission", "Territorial Emission Analysis", steps=[
+    YearSlider("Select Year", latest=True), CountryChart('Territorial Emission')])
+#******************************************************************************************************************************
+#  Fossil Emission
+FOSSIL_COLUMNS = ['fossil.emissions.excluding.carbonation', 'Coal', 'Oil', 'Gas', 'Cement.emission', 'Flaring', 'Other']
+FOSSIL_PAGE = PageSpec("Fossil Emission", "Fossil Emission Analysis", columns=['Year'] + FOSSIL_COLUMNS, steps=[
+    Text("Fossil Emissions Over the Years:", "subheader"),
+    Chart("figFossilEmission", lambda view: px.line(chartFrame(view.yearData().frame, FOSSIL_COLUMNS), x='Year', y=FOSSIL_COLUMNS,
+                                                    title='Fossil Emissions Over the Years',
+                                                    labels={'value': 'Emissions', 'Year': 'Year'},
+                                                    line_shape='linear',
+                                                    template='plotly_dark')),
+    DerivedSeries(),
+])
+#******************************************************************************************************************************
+# Page registry, the navigation bar and the schema checks of the dataset picker are both read from here
+PAGES = {spec.name: spec for spec in [CEMENT_PAGE, GLOBAL_BUDGET_PAGE, HISTORICAL_BUDGET_PAGE, LAND_USE_PAGE, OCEAN_SINK_PAGE,
+                                      TERRESTRIAL_SINK_PAGE, CONSUMPTION_PAGE, TRANSFER_PAGE, TERRITORIAL_PAGE, FOSSIL_PAGE]}
+# pages with a fixed schema are only offered datasets that carry their columns
+REQUIRED_COLUMNS = {name: spec.columns for name, spec in PAGES.items() if spec.columns}
 #******************************************************************************************************************************
 # Navigation bar
-selected_page = st.sidebar.selectbox("Select Page", ["Welcome", "Cement Carbon Emission", "Global Carbon Budget",
-                                                     "Historical Budget", "Land Use Change Emission", "Ocean Sink",
-                                                     "Terrestrial Sink", "Consumption Emission", "Emission Transfer",
-                                                     "Territorial Emission","Fossil Emission"])
+selected_page = st.sidebar.selectbox("Select Page", ["Welcome"] + list(PAGES))
+# Streaming reads big files in chunks with compact dtypes (int16 years, float32 values, categorical names),
+# out-of-core keeps them on disk as a memory-mapped Arrow file
+ingestionMode = st.sidebar.radio("Ingestion mode", ["Auto", "Standard", "Streaming", "Out-of-core"], key="ingestionMode",
+                                 help=f"Auto streams files larger than {dataEngine.STREAMING_THRESHOLD_MB} MB and keeps "
+                                      f"files larger than {storeEngine.OUT_OF_CORE_THRESHOLD_MB} MB out of core.")
+if ingestionMode in ("Auto", "Out-of-core"):
+    st.sidebar.selectbox("Rows of a year combined by (out of core)", storeEngine.YEARLY_REDUCTIONS, key="outOfCoreReduction")
+# Downsampling of line/area charts and the encoding of chart data sent to the browser
+with st.sidebar.expander("Chart Downsampling"):
+    st.checkbox("Downsample time series", key="downsampleEnabled")
+    st.selectbox("Method", figureEngine.DOWNSAMPLE_METHODS, key="downsampleMethod")
+    st.number_input("Max points per chart", min_value=100, max_value=100000, value=2000, step=100, key="downsampleMaxPoints")
+    st.checkbox("Send chart data as float32", value=True, key="compactCharts",
+                help="Halves the chart payload, values keep about 7 significant digits.")
+
+# one recorder per rerun, the stages above report into it
+perf = perfMonitor.RerunRecorder(selected_page, trackMemory=st.session_state.get("perfTrackMemory", False))
+
+# Whole Global Carbon Budget workbook in one upload
+with st.sidebar.expander("Workbook Upload"):
+    workbookFile = st.file_uploader("Upload the Global Carbon Budget workbook", type=["xlsx"], key="workbookUpload")
+    if workbookFile is not None:
+        workbookUpload(workbookFile)
 
 # Load data 
 if selected_page == "Welcome":
     welcomPage()
-elif selected_page == "Cement Carbon Emission":
-    cementEmissionPage()
-elif selected_page == "Global Carbon Budget":
-    globalCarbonBudgetPage()
-elif selected_page == "Historical Budget":
-    historicalBudgetPage()
-elif selected_page == "Land Use Change Emission":
-    landUseChangeEmissionPage()
-elif selected_page == "Ocean Sink":
-    oceanSinkPage()
-elif selected_page == "Terrestrial Sink":
-    terrestrialSinkPage()
-elif selected_page == "Consumption Emission":
-    consumptionEmissionPage()
-elif selected_page == "Emission Transfer":
-    emissionTransferPage()
-elif selected_page == "Territorial Emission":
-    territorialEmissionPage()
-elif selected_page == "Fossil Emission":
-    fossilEmissionPage()
-    
+else:
+    runPage(PAGES[selected_page])
+
+# Datasets registered in this session
+with st.sidebar.expander("Datasets"):
+    st.dataframe(datasetRegistry().summary(), hide_index=True)
+    if st.button("Forget unused datasets"):
+        datasetRegistry().forgetUnreferenced()
+
+# Loader cache statistics
+with st.sidebar.expander("Loader Cache"):
+    loaderStats = dataEngine.loaderCache.stats()
+    st.write(f"Entries: {loaderStats['entries']} / {loaderStats['maxEntries']}")
+    st.write(f"Memory: {loaderStats['bytes'] / 1024**2:.1f} MB / {loaderStats['maxBytes'] / 1024**2:.0f} MB")
+    st.write(f"Hits: {loaderStats['hits']}  Misses: {loaderStats['misses']}  Evictions: {loaderStats['evictions']}")
+    if st.button("Clear loader cache"):
+        dataEngine.loaderCache.clear()
+
+# Columnar disk cache admin view
+with st.sidebar.expander("Disk Cache"):
+    if not dataEngine.diskCache.enabled:
+        st.write("Disk cache disabled: install pyarrow to enable it.")
+    else:
+        diskEntries = dataEngine.diskCache.summary()
+        st.write(f"Location: {dataEngine.diskCache.directory}")
+        st.write(f"Used: {diskEntries['Size (MB)'].sum():.1f} MB / {dataEngine.diskCache.maxBytes / 1024**2:.0f} MB")
+        st.dataframe(diskEntries, hide_index=True)
+        st.write(f"Out-of-core stores: {storeEngine.storeBytes() / 1024**2:.1f} MB / {storeEngine.STORE_MB} MB")
+        if st.button("Clear disk cache"):
+            dataEngine.diskCache.clear()
+            storeEngine.clearStores()
+
+# Per-rerun timing overlay
+perfRecord = perf.finish()
+perfHistory = st.session_state.setdefault("perfHistory", [])
+perfHistory.append(perfRecord)
+del perfHistory[:-50]
+if st.session_state.get("perfWriteLog", False):
+    perfMonitor.appendJsonl(perfMonitor.PERF_LOG_PATH, perfRecord)
+with st.sidebar.expander("Performance"):
+    st.write(f"Last rerun ({perfRecord['page']}): {perfRecord['totalSeconds'] * 1000:.1f} ms")
+    st.dataframe(perfMonitor.stageTable(perfRecord), hide_index=True)
+    st.write("Per page (this session):")
+    st.dataframe(perfMonitor.pageSummary(perfHistory), hide_index=True)
+    st.checkbox("Track peak memory", key="perfTrackMemory", help="Uses tracemalloc, which slows reruns down while it is on.")
+    st.checkbox("Measure chart payload", key="perfMeasurePayload", help="Serializes each chart once more to count its bytes.")
+    st.checkbox("Build figures concurrently", value=True, key="concurrentFigures",
+                help=f"Builds the charts of a page on {figureEngine.FIGURE_WORKERS} worker threads, "
+                     f"each with a {figureEngine.FIGURE_TIMEOUT_S:g} s deadline. Off while peak memory is tracked.")
+    st.checkbox("Write JSONL log", key="perfWriteLog")
+    # the server decides where the log goes, a browser only sees the path
+    st.text_input("Log file (CARBON_PERF_LOG)", value=perfMonitor.PERF_LOG_PATH, disabled=True)
 
 
 
@@ -0,0 +1,390 @@
+#Libraries
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+#******************************************************************************************************************************
+# Headless benchmark
+# Runs app.py the way Streamlit does (the whole script, once per rerun) against a stand-in `st` module and
+# synthetic Global Carbon Budget shaped uploads. Stage timings come from the app's own perfMonitor recorder,
+# so the numbers here are the same stages the sidebar Performance panel shows.
+#
+#   python benchmark.py                                   # small grid, JSON on stdout
+#   python benchmark.py --scale full --output bench.json  # 100 .. 10M rows, 10 .. 250 countries
+#   python benchmark.py --import-time                     # cold start: library imports and first render
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+SCALES = {"small": ([100, 1000, 10000], [10, 50]),
+          "full": ([100, 10000, 1000000, 10000000], [10, 50, 250])}
+STAGE_GROUPS = [("load", "load"), ("nulls", "null handling"), ("filter", "filter"), ("reshape", "reshape"),
+                ("profile", "profile:"), ("figures", "figure:"), ("serialize", "render:")]
+HEAVY_MODULES = ["streamlit", "pandas", "pyarrow", "plotly.graph_objects", "plotly.express", "matplotlib.pyplot",
+                 "seaborn", "geopandas"]
+COLD_START_PAGES = [("Welcome", None, None), ("Cement Carbon Emission", "series", ["GCB", "Cao", "Huang"])]
+#******************************************************************************************************************************
+# Stand-in streamlit module
+class SessionState(dict):
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class StubStreamlit:
+    def __init__(self):
+        self.session_state = SessionState()
+        self.sidebar = self
+        self.upload = None
+        self.choices = {}
+        self.payloadBytes = 0
+
+    # anything the app draws but the benchmark does not care about
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self.noop
+
+    def noop(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        return iter(())
+
+    def remember(self, key, value):
+        if key is not None:
+            self.session_state[key] = value
+        return value
+
+    def pick(self, label, key, default):
+        if label in self.choices:
+            return self.remember(key, self.choices[label])
+        if key is not None and key in self.session_state:
+            return self.session_state[key]
+        return self.remember(key, default)
+
+    def file_uploader(self, label, type=None, key=None, **kwargs):
+        # the synthetic upload goes to the page's CSV uploader, the workbook and append uploaders stay empty
+        return self.upload if key is None and (type is None or "csv" in type) else None
+
+    def selectbox(self, label, options, index=0, key=None, **kwargs):
+        options = list(options)
+        return self.pick(label, key, options[index] if options else None)
+
+    def radio(self, label, options, index=0, key=None, **kwargs):
+        return self.selectbox(label, options, index=index, key=key)
+
+    def multiselect(self, label, options, default=None, key=None, **kwargs):
+        return self.pick(label, key, list(default or []))
+
+    def slider(self, label, min_value=None, max_value=None, value=None, key=None, **kwargs):
+        return self.pick(label, key, min_value if value is None else value)
+
+    def number_input(self, label, min_value=None, max_value=None, value=None, key=None, **kwargs):
+        return self.pick(label, key, min_value if value is None else value)
+
+    def text_input(self, label, value="", key=None, **kwargs):
+        return self.pick(label, key, value)
+
+    def checkbox(self, label, value=False, key=None, **kwargs):
+        return self.pick(label, key, value)
+
+    def toggle(self, label, value=False, key=None, **kwargs):
+        return self.pick(label, key, value)
+
+    def button(self, *args, **kwargs):
+        return False
+
+    def columns(self, spec, **kwargs):
+        return [self] * (spec if isinstance(spec, int) else len(spec))
+
+    def tabs(self, labels, **kwargs):
+        return [self] * len(labels)
+
+    def plotly_chart(self, figure, *args, **kwargs):
+        # the serialization Streamlit itself performs before anything reaches the browser
+        import plotly.io
+        self.payloadBytes += len(plotly.io.to_json(figure, validate=False))
+        return self
+#******************************************************************************************************************************
+# Synthetic datasets
+def yearColumn(rows):
+    # more rows than years means several rows per year, like monthly or gridded extracts
+    return (1750 + (np.arange(rows) * 274) // max(rows, 1)).astype("int64")
+
+
+def withNulls(frame, rng, fraction=0.01):
+    values = frame.columns[1:]
+    for column in values:
+        holes = rng.random(len(frame)) < fraction
+        frame.loc[holes, column] = np.nan
+    return frame
+
+
+def seriesFrame(rows, columns, rng):
+    frame = pd.DataFrame({"Year": yearColumn(rows)})
+    for column in columns:
+        frame[column] = rng.random(rows).cumsum() / max(rows, 1) * 10
+    return withNulls(frame, rng)
+
+
+def countryFrame(rows, countries, rng):
+    frame = pd.DataFrame({"Year": yearColumn(rows)})
+    matrix = rng.random((rows, countries)) * 100
+    frame = pd.concat([frame, pd.DataFrame(matrix, columns=[f"Country {i:03d}" for i in range(countries)])], axis=1)
+    frame["World"] = matrix.sum(axis=1)
+    return withNulls(frame, rng)
+
+
+BUDGET_COLUMNS = ["fossil emissions excluding carbonation", "land-use change emissions", "atmospheric growth",
+                  "ocean sink", "land sink", "cement carbonation sink", "budget imbalance"]
+LAND_USE_COLUMNS = ["land-use change emissions", "deforestation (total)", "forest regrowth (total)", "other transitions",
+                    "wood harvest & other forest management", "peat drainage & peat fires"]
+SINK_COLUMNS = ["GCB", "CESM-ETH", "CNRM", "EC-Earth", "FESOM", "IPSL", "MPI", "NorESM"]
+FOSSIL_COLUMNS = ["fossil.emissions.excluding.carbonation", "Coal", "Oil", "Gas", "Cement.emission", "Flaring", "Other"]
+
+PAGES = [("Cement Carbon Emission", "series", ["GCB", "Cao", "Huang"]),
+         ("Global Carbon Budget", "series", BUDGET_COLUMNS),
+         ("Historical Budget", "series", BUDGET_COLUMNS),
+         ("Land Use Change Emission", "series", LAND_USE_COLUMNS),
+         ("Ocean Sink", "series", SINK_COLUMNS),
+         ("Terrestrial Sink", "series", SINK_COLUMNS),
+         ("Consumption Emission", "country", None),
+         ("Emission Transfer", "country", None),
+         ("Territorial Emission", "country", None),
+         ("Fossil Emission", "series", FOSSIL_COLUMNS)]
+
+
+def makeUpload(kind, columns, rows, countries, seed=0):
+    rng = np.random.default_rng(seed)
+    if kind == "country":
+        frame = countryFrame(rows, countries, rng)
+    else:
+        frame = seriesFrame(rows, columns, rng)
+    buffer = io.BytesIO()
+    frame.to_csv(buffer, index=False)
+    buffer.seek(0)
+    buffer.name = "synthetic.csv"
+    return buffer
+#******************************************************************************************************************************
+# Runner
+def installStub(cacheDir):
+    os.environ["CARBON_DISK_CACHE_DIR"] = cacheDir
+    stub = StubStreamlit()
+    sys.modules["streamlit"] = stub
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+    return stub
+
+
+def clearCaches():
+    import dataEngine
+    import figureEngine
+    import storeEngine
+    dataEngine.loaderCache.clear()
+    dataEngine.derivedCache.clear()
+    dataEngine.diskCache.clear()
+    storeEngine.clearStores()
+    figureEngine.figureCache.clear()
+
+
+def rerun(stub):
+    stub.payloadBytes = 0
+    started = time.perf_counter()
+    scriptGlobals = runpy.run_path(APP_PATH, run_name="__main__")
+    elapsed = time.perf_counter() - started
+    return scriptGlobals.get("perfRecord"), elapsed
+
+
+def stageGroup(stage):
+    for name, prefix in STAGE_GROUPS:
+        if stage is not None and stage.startswith(prefix):
+            return name
+    return None
+
+
+def groupStages(record):
+    grouped = {name: 0.0 for name, _ in STAGE_GROUPS}
+    peaks = {name: 0 for name, _ in STAGE_GROUPS}
+    for stage in record["stages"] if record else []:
+        name = stageGroup(stage["stage"])
+        if name is None:
+            continue
+        grouped[name] += stage["seconds"]
+        peaks[name] = max(peaks[name], stage.get("peakBytes", 0))
+        # a nested stage (a slice built inside a figure build) is already part of its parent's time
+        parent = stageGroup(stage.get("parent"))
+        if parent is not None:
+            grouped[parent] -= stage["seconds"]
+    return grouped, peaks
+
+
+def benchmarkPage(stub, page, kind, columns, rows, countries, nullOption, trackMemory, ingestion="Auto", concurrent=True):
+    stub.session_state.clear()
+    stub.session_state["perfTrackMemory"] = trackMemory
+    stub.session_state["concurrentFigures"] = concurrent
+    stub.choices = {"Select Page": page, "How to handle null values:": nullOption, "Ingestion mode": ingestion}
+    stub.upload = makeUpload(kind, columns, rows, countries)
+    uploadBytes = len(stub.upload.getvalue())
+    results = []
+    clearCaches()
+    # cold: nothing cached, warm: the same rerun again as after moving an unrelated widget
+    for run in ("cold", "warm"):
+        try:
+            record, elapsed = rerun(stub)
+            error = None
+        except Exception as exc:  # one failing page must not end the whole benchmark
+            record, elapsed, error = None, 0.0, f"{type(exc).__name__}: {exc}"
+        grouped, peaks = groupStages(record)
+        results.append({"page": page, "rows": rows, "countries": countries if kind == "country" else None,
+                        "uploadBytes": uploadBytes, "run": run, "totalSeconds": elapsed,
+                        "stageSeconds": grouped, "stagePeakBytes": peaks if trackMemory else None,
+                        "payloadBytes": stub.payloadBytes, "error": error})
+    return results
+
+
+#******************************************************************************************************************************
+# Cold start
+# Every measurement runs in a fresh interpreter, which is what a new container or a scaled-up replica pays.
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+COLD_START_SNIPPET = """
+import json, sys, tempfile, time
+started = time.perf_counter()
+sys.path.insert(0, {directory!r})
+import benchmark
+stub = benchmark.installStub(tempfile.mkdtemp(prefix="carbon-bench-"))
+stub.choices = {{"Select Page": {page!r}}}
+if {kind!r} is not None:
+    stub.upload = benchmark.makeUpload({kind!r}, {columns!r}, 1000, 10)
+benchmark.rerun(stub)
+# the stand-in registered as streamlit does not count as the real one
+loaded = [name for name in benchmark.HEAVY_MODULES if name in sys.modules and sys.modules[name] is not stub]
+print(json.dumps({{"seconds": time.perf_counter() - started, "loaded": loaded}}))
+"""
+
+
+def runSnippet(code):
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if completed.returncode != 0:
+        return None
+    return completed.stdout.strip().splitlines()[-1]
+
+
+def importTimes(repeats):
+    rows = []
+    for module in HEAVY_MODULES:
+        runs = [runSnippet(IMPORT_SNIPPET.format(module=module)) for _ in range(repeats)]
+        seconds = [float(run) for run in runs if run is not None]
+        rows.append({"module": module, "seconds": min(seconds) if seconds else None, "available": bool(seconds)})
+    return rows
+
+
+def coldStarts(repeats):
+    rows = []
+    directory = os.path.dirname(APP_PATH)
+    for page, kind, columns in COLD_START_PAGES:
+        code = COLD_START_SNIPPET.format(directory=directory, page=page, kind=kind, columns=columns)
+        runs = [runSnippet(code) for _ in range(repeats)]
+        results = [json.loads(run) for run in runs if run is not None]
+        rows.append({"page": page, "upload": kind is not None,
+                     "seconds": min(result["seconds"] for result in results) if results else None,
+                     "modulesLoaded": results[0]["loaded"] if results else None})
+    return rows
+
+
+def environment():
+    versions = {}
+    for name in ("pandas", "numpy", "plotly", "pyarrow"):
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(),
+            "cpus": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "versions": versions}
+
+
+def parseSizes(text):
+    return [int(float(part)) for part in text.split(",") if part.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmark of every analysis page in app.py.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--rows", help="comma separated row counts, overrides --scale")
+    parser.add_argument("--countries", help="comma separated country column counts, overrides --scale")
+    parser.add_argument("--pages", help="comma separated page names (default: all)")
+    parser.add_argument("--max-cells", type=float, default=5e7, help="skip country tables larger than this many cells")
+    parser.add_argument("--null-option", default="Impute by Median")
+    parser.add_argument("--ingestion", choices=["Auto", "Standard", "Streaming", "Out-of-core"], default="Auto",
+                        help="ingestion mode picked in the sidebar, Out-of-core keeps maxRssBytes flat as rows grow")
+    parser.add_argument("--sequential-figures", action="store_true",
+                        help="build the figures of a page one after another, implied unless --no-memory is given")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc peak memory tracking")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--import-time", action="store_true",
+                        help="measure library import times and the first render in fresh interpreters instead")
+    parser.add_argument("--repeats", type=int, default=3, help="fresh interpreters per cold start measurement (best is kept)")
+    args = parser.parse_args(argv)
+
+    if args.import_time:
+        report = {"environment": environment(), "imports": importTimes(args.repeats), "coldStart": coldStarts(args.repeats)}
+        writeReport(report, args.output)
+        return
+
+    rowSizes, countrySizes = SCALES[args.scale]
+    rowSizes = parseSizes(args.rows) if args.rows else rowSizes
+    countrySizes = parseSizes(args.countries) if args.countries else countrySizes
+    wanted = set(part.strip() for part in args.pages.split(",")) if args.pages else None
+
+    # tracemalloc keeps one peak for the whole process, figures built on the pool would reset each other's stage peaks
+    concurrent = args.no_memory and not args.sequential_figures
+    with tempfile.TemporaryDirectory(prefix="carbon-bench-") as cacheDir:
+        stub = installStub(cacheDir)
+        results, skipped = [], []
+        for page, kind, columns in PAGES:
+            if wanted and page not in wanted:
+                continue
+            for rows in rowSizes:
+                for countries in (countrySizes if kind == "country" else [None]):
+                    if kind == "country" and rows * countries > args.max_cells:
+                        skipped.append({"page": page, "rows": rows, "countries": countries})
+                        continue
+                    print(f"{page}: {rows} rows" + (f" x {countries} countries" if countries else ""), file=sys.stderr)
+                    results.extend(benchmarkPage(stub, page, kind, columns, rows, countries,
+                                                 args.null_option, not args.no_memory, args.ingestion, concurrent))
+        report = {"environment": environment(), "nullOption": args.null_option, "ingestion": args.ingestion,
+                  "concurrentFigures": concurrent,
+                  "results": results, "skipped": skipped,
+                  "maxRssBytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+    writeReport(report, args.output)
+
+
+def writeReport(report, output):
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1092 @@
+#Libraries
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow.feather as feather
+except ImportError:  # the disk cache is simply switched off without pyarrow
+    feather = None
+#******************************************************************************************************************************
+# Settings
+# app.py is re-executed by Streamlit on every rerun, this module is imported once per server process
+# so everything cached here survives slider drags, selectbox changes and page switches.
+LOADER_CACHE_ENTRIES = int(os.environ.get("CARBON_LOADER_CACHE_ENTRIES", "16"))
+LOADER_CACHE_MB = int(os.environ.get("CARBON_LOADER_CACHE_MB", "1024"))
+DISK_CACHE_DIR = os.environ.get("CARBON_DISK_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "carbon-emission-viz"))
+DISK_CACHE_MB = int(os.environ.get("CARBON_DISK_CACHE_MB", "4096"))
+STREAMING_THRESHOLD_MB = int(os.environ.get("CARBON_STREAMING_THRESHOLD_MB", "64"))
+STREAMING_CHUNK_ROWS = int(os.environ.get("CARBON_STREAMING_CHUNK_ROWS", "100000"))
+CATEGORY_MAX_RATIO = 0.5
+DERIVED_CACHE_ENTRIES = int(os.environ.get("CARBON_DERIVED_CACHE_ENTRIES", "256"))
+DERIVED_CACHE_MB = int(os.environ.get("CARBON_DERIVED_CACHE_MB", "1024"))
+YEAR_FRAME_ENTRIES = 64
+SESSION_DATASETS = int(os.environ.get("CARBON_SESSION_DATASETS", "16"))
+WORKBOOK_WORKERS = int(os.environ.get("CARBON_WORKBOOK_WORKERS", str(os.cpu_count() or 1)))
+HEADER_SEARCH_ROWS = 60
+#******************************************************************************************************************************
+# Bounded LRU cache
+def frameBytes(value):
+    if hasattr(value, "cacheBytes"):
+        return value.cacheBytes()
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    return 0
+
+
+_missing = object()
+
+
+class LruCache:
+    def __init__(self, maxEntries, maxBytes=None, sizeOf=frameBytes):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.sizeOf = sizeOf
+        self.entries = OrderedDict()
+        self.totalBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.totalBytes -= self.entries.pop(key)[1]
+            size = self.sizeOf(value)
+            # an entry bigger than the whole budget is not worth keeping
+            if self.maxBytes is not None and size > self.maxBytes:
+                return value
+            self.entries[key] = (value, size)
+            self.totalBytes += size
+            while len(self.entries) > self.maxEntries or (self.maxBytes is not None and self.totalBytes > self.maxBytes):
+                _, (_, evictedSize) = self.entries.popitem(last=False)
+                self.totalBytes -= evictedSize
+                self.evictions += 1
+            return value
+
+    def getOrCompute(self, key, compute):
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = self.put(key, compute())
+        return value
+
+    def items(self):
+        with self.lock:
+            return [(key, value) for key, (value, _) in self.entries.items()]
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.totalBytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.totalBytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "maxEntries": self.maxEntries,
+                    "bytes": self.totalBytes, "maxBytes": self.maxBytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+loaderCache = LruCache(LOADER_CACHE_ENTRIES, LOADER_CACHE_MB * 1024 * 1024)
+# everything computed from a loaded frame (indexes, reshapes, statistics) lives here, keyed by datasetKey
+derivedCache = LruCache(DERIVED_CACHE_ENTRIES, DERIVED_CACHE_MB * 1024 * 1024)
+
+
+def datasetKey(data):
+    return data.attrs.get('datasetKey')
+
+
+def withDatasetKey(data, key):
+    data.attrs = {**data.attrs, 'datasetKey': key}
+    return data
+
+
+def cachedDerived(data, kind, compute, *params):
+    key = datasetKey(data)
+    if key is None:
+        return compute()
+    return derivedCache.getOrCompute((key, kind) + params, compute)
+#******************************************************************************************************************************
+# Columnar on-disk cache
+# Parsed uploads are written once as uncompressed Feather (Arrow IPC) files named by content hash.
+# Reads are memory-mapped, so numeric columns come back without copying and a server restart
+# only pays for the pages it actually touches. Least recently used files are evicted past the size cap.
+class DiskCache:
+    suffix = ".feather"
+
+    def __init__(self, directory, maxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return feather is not None
+
+    def pathFor(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def load(self, key):
+        if not self.enabled:
+            return None
+        path = self.pathFor(key)
+        try:
+            table = feather.read_table(path, memory_map=True)
+        except (FileNotFoundError, OSError):
+            return None
+        # mtime doubles as the last-used stamp for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return table.to_pandas(split_blocks=True)
+
+    def store(self, key, data):
+        if not self.enabled:
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.pathFor(key)
+        tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            feather.write_feather(data.reset_index(drop=True), tmpPath, compression="uncompressed")
+            os.replace(tmpPath, path)
+        except Exception:
+            # odd mixed-type object columns cannot always be expressed in Arrow, keep the upload in memory only
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            return False
+        self.evict()
+        return True
+
+    def entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            found.append({"key": name[:-len(self.suffix)], "bytes": info.st_size, "lastUsed": info.st_mtime})
+        found.sort(key=lambda entry: entry["lastUsed"], reverse=True)
+        return found
+
+    def evict(self):
+        with self.lock:
+            found = self.entries()
+            total = sum(entry["bytes"] for entry in found)
+            while found and total > self.maxBytes:
+                oldest = found.pop()
+                self.remove(oldest["key"])
+                total -= oldest["bytes"]
+
+    def remove(self, key):
+        try:
+            os.remove(self.pathFor(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for entry in self.entries():
+            self.remove(entry["key"])
+
+    def summary(self):
+        rows = []
+        for entry in self.entries():
+            rows.append({"Key": entry["key"], "Size (MB)": round(entry["bytes"] / 1024**2, 2),
+                         "Last Used": time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["lastUsed"]))})
+        return pd.DataFrame(rows, columns=["Key", "Size (MB)", "Last Used"])
+
+
+diskCache = DiskCache(DISK_CACHE_DIR, DISK_CACHE_MB * 1024 * 1024)
+#******************************************************************************************************************************
+# Content hashing
+def readUploadBytes(pathFile):
+    # Streamlit's UploadedFile is a BytesIO, benchmarks and scripts pass plain paths
+    if isinstance(pathFile, (str, os.PathLike)):
+        with open(pathFile, "rb") as handle:
+            return handle.read()
+    if hasattr(pathFile, "getvalue"):
+        return pathFile.getvalue()
+    position = pathFile.tell()
+    pathFile.seek(0)
+    raw = pathFile.read()
+    pathFile.seek(position)
+    return raw
+
+
+def contentHash(raw):
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def fileKey(path):
+    # a stat instead of a read, for files too large to hash
+    info = os.stat(path)
+    return contentHash(f"{os.path.abspath(path)}:{info.st_size}:{info.st_mtime_ns}".encode())
+
+
+# Streamlit hands the same UploadedFile (same file_id) back on every rerun, it is hashed the first time it is seen only
+uploadHashes = LruCache(1024, sizeOf=lambda value: 0)
+
+
+def uploadHash(pathFile, read=readUploadBytes):
+    fileId = getattr(pathFile, "file_id", None)
+    if fileId is None:
+        return contentHash(read(pathFile))
+    return uploadHashes.getOrCompute((fileId, getattr(pathFile, "size", None)), lambda: contentHash(read(pathFile)))
+
+
+def uploadSize(pathFile):
+    if isinstance(pathFile, (str, os.PathLike)):
+        return os.path.getsize(pathFile)
+    size = getattr(pathFile, "size", None)
+    return size if size is not None else len(readUploadBytes(pathFile))
+#******************************************************************************************************************************
+# Parsing
+def parseCsv(raw):
+    data = pd.read_csv(io.BytesIO(raw))
+    data = data.dropna(axis=1, how='all')
+    return data
+#******************************************************************************************************************************
+# Streaming ingestion
+# The file is read in row chunks and every chunk is shrunk before the next one is parsed:
+# integers go to the smallest int that fits (int16 for Year), floats to float32 and
+# repetitive text (country names) to categoricals. Peak memory stays near the compact footprint.
+def planCategories(chunk):
+    planned = []
+    for col in chunk.columns:
+        series = chunk[col]
+        if pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            if series.nunique(dropna=True) <= max(1, int(len(series) * CATEGORY_MAX_RATIO)):
+                planned.append(col)
+    return planned
+
+
+def shareCategories(parts):
+    # categoricals only concatenate as categoricals when every part shares the same categories. A part where the
+    # column is all empty is read as float64 and has no categories, so the dtype comes from the parts that have some.
+    parts = [part if isinstance(part.dtype, pd.CategoricalDtype) else part.astype('category') for part in parts]
+    categories = None
+    for part in parts:
+        known = part.cat.categories
+        if categories is None:
+            categories = known if len(known) else None
+        elif len(known):
+            categories = categories.append(known[~known.isin(categories)])
+    if categories is None:
+        return parts
+    dtype = pd.CategoricalDtype(categories)
+    return [part.astype(dtype) for part in parts]
+
+
+def compactChunk(chunk, categoryColumns):
+    for col in chunk.columns:
+        series = chunk[col]
+        if col in categoryColumns:
+            chunk[col] = series.astype('category')
+        elif pd.api.types.is_bool_dtype(series):
+            continue
+        elif pd.api.types.is_integer_dtype(series):
+            chunk[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            chunk[col] = series.astype('float32')
+    return chunk
+
+
+def parseCsvStreaming(raw, chunkRows=STREAMING_CHUNK_ROWS, progress=None):
+    buffer = io.BytesIO(raw)
+    chunks = []
+    categoryColumns = None
+    seenValues = set()
+    for chunk in pd.read_csv(buffer, chunksize=chunkRows):
+        if categoryColumns is None:
+            categoryColumns = planCategories(chunk)
+        seenValues.update(chunk.columns[chunk.notna().any()])
+        chunks.append(compactChunk(chunk, categoryColumns))
+        if progress is not None:
+            progress(buffer.tell() / max(len(raw), 1))
+    if not chunks:
+        return pd.read_csv(io.BytesIO(raw))
+    for col in categoryColumns:
+        for chunk, part in zip(chunks, shareCategories([chunk[col] for chunk in chunks])):
+            chunk[col] = part
+    data = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+    del chunks
+    emptyColumns = [col for col in data.columns if col not in seenValues]
+    if emptyColumns:
+        data = data.drop(columns=emptyColumns)
+    if progress is not None:
+        progress(1.0)
+    return data
+#******************************************************************************************************************************
+# Loader
+def loadCsv(pathFile, streaming=None, progress=None):
+    # big uploads stream automatically unless the caller decides
+    if streaming is None:
+        streaming = uploadSize(pathFile) > STREAMING_THRESHOLD_MB * 1024 * 1024
+    key = uploadHash(pathFile) + ("-compact" if streaming else "")
+    data = loaderCache.get(key)
+    if data is None:
+        data = diskCache.load(key)
+        if data is None:
+            raw = readUploadBytes(pathFile)
+            data = parseCsvStreaming(raw, progress=progress) if streaming else parseCsv(raw)
+            diskCache.store(key, data)
+        data.attrs['datasetKey'] = key
+        loaderCache.put(key, data)
+    # shallow copy so a page adding a column never leaks it into the cached frame
+    return data.copy(deep=False)
+#******************************************************************************************************************************
+# Year index
+# Sorted by Year once, after that a range or single year is two binary searches and an iloc slice
+# (a view, nothing is copied) instead of a boolean mask over the whole table on every figure.
+class YearIndexedData:
+    def __init__(self, data, yearColumn='Year'):
+        # a frame already in year order keeps its row order, appended releases rely on that
+        self.resorted = not data[yearColumn].is_monotonic_increasing
+        if self.resorted:
+            data = data.sort_values(yearColumn, kind='stable', ignore_index=True)
+        else:
+            data = data.copy(deep=False)
+        self.frame = data
+        self.yearColumn = yearColumn
+        years = data[yearColumn].to_numpy(dtype='float64', na_value=np.nan)
+        # missing years sort to the end and are never part of a year query
+        self.validRows = int(np.count_nonzero(~np.isnan(years)))
+        self.years = years[:self.validRows]
+
+    def cacheBytes(self):
+        return frameBytes(self.frame) + self.years.nbytes
+
+    def bounds(self):
+        return int(self.years[0]), int(self.years[-1])
+
+    def rowRange(self, low, high):
+        start = int(np.searchsorted(self.years, low, side='left'))
+        stop = int(np.searchsorted(self.years, high, side='right'))
+        return start, stop
+
+    def between(self, low, high):
+        start, stop = self.rowRange(low, high)
+        return self.frame.iloc[start:stop]
+
+    def at(self, year):
+        return self.between(year, year)
+
+    def extended(self, appended, delta):
+        # the appended frame is this frame followed by later years, only the new years are read
+        extended = object.__new__(YearIndexedData)
+        extended.resorted = False
+        extended.frame = appended.copy(deep=False)
+        extended.yearColumn = self.yearColumn
+        extended.years = np.concatenate([self.years, delta[self.yearColumn].to_numpy(dtype='float64', na_value=np.nan)])
+        extended.validRows = len(extended.years)
+        return extended
+
+
+def indexByYear(data, yearColumn='Year'):
+    return cachedDerived(data, 'yearIndex', lambda: YearIndexedData(data, yearColumn), yearColumn)
+#******************************************************************************************************************************
+# Country reshapes
+# The country pages only ever need per-country totals over a year range of a wide Year x Country table.
+# The country columns are pulled into one numeric matrix once per dataset, after that a range is a row slice of
+# that matrix and the vector summed from it is cached, so a slider move never melts the table again.
+class CountryReshape:
+    def __init__(self, data, countryColumns, yearColumn='Year'):
+        yearData = indexByYear(data, yearColumn)
+        # only the matrix and the year order are kept, not the frame they were read from
+        self.yearColumn = yearColumn
+        self.years = yearData.years
+        self.countries = np.asarray(list(countryColumns), dtype=object)
+        self.matrix = yearData.frame[list(countryColumns)].to_numpy()
+        self.rangeVectors = LruCache(YEAR_FRAME_ENTRIES, sizeOf=lambda value: value.nbytes)
+        self.numeric = None
+
+    def cacheBytes(self):
+        numericBytes = 0 if self.numeric is None or self.numeric is self.matrix else self.numeric.nbytes
+        return self.matrix.nbytes + numericBytes + self.countries.nbytes + self.years.nbytes + self.rangeVectors.totalBytes
+
+    def numericMatrix(self):
+        # float64 with NaN for anything missing or not a number, what the ranking queries run on
+        if self.numeric is None:
+            if self.matrix.dtype.kind in "iuf":
+                self.numeric = self.matrix.astype(np.float64, copy=False)
+            else:
+                self.numeric = pd.DataFrame(self.matrix).apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        return self.numeric
+
+    def computeRangeTotals(self, low, high):
+        start = int(np.searchsorted(self.years, low, side='left'))
+        stop = int(np.searchsorted(self.years, high, side='right'))
+        block = self.numericMatrix()[start:stop]
+        if len(block) == 1:
+            return block[0]
+        totals = np.nansum(block, axis=0)
+        # a country with no value in the whole range stays missing instead of becoming 0
+        totals[np.isnan(block).all(axis=0)] = np.nan
+        return totals
+
+    def rangeTotals(self, low, high):
+        return self.rangeVectors.getOrCompute((low, high), lambda: self.computeRangeTotals(low, high))
+
+    def extended(self, appended, delta):
+        extended = object.__new__(CountryReshape)
+        extended.yearColumn = self.yearColumn
+        extended.years = indexByYear(appended, self.yearColumn).years
+        extended.countries = self.countries
+        extended.matrix = np.concatenate([self.matrix, delta[list(self.countries)].to_numpy()])
+        # appended years are all new, every range that ends before them is still exact
+        extended.rangeVectors = LruCache(YEAR_FRAME_ENTRIES, sizeOf=lambda value: value.nbytes)
+        firstNewYear = delta[self.yearColumn].min()
+        for (low, high), value in self.rangeVectors.items():
+            if high < firstNewYear:
+                extended.rangeVectors.put((low, high), value)
+        extended.numeric = None
+        return extended
+
+
+def columnsKey(columns):
+    # Index.tolist() is an order of magnitude faster than iterating the Index itself
+    return tuple(columns.tolist() if hasattr(columns, "tolist") else columns)
+
+
+def reshapeCountries(data, countryColumns, yearColumn='Year'):
+    return cachedDerived(data, 'countryReshape', lambda: CountryReshape(data, countryColumns, yearColumn),
+                         columnsKey(countryColumns), yearColumn)
+#******************************************************************************************************************************
+# Country rankings
+# Top-N, bottom-N, percentile and share-of-total queries for a year or a year range. The per-country totals
+# of a range come from the reshape's numeric matrix and are cached, picking N countries out of them is an
+# argpartition (linear in the number of countries) and only the N picked values are sorted.
+# The national sheets also carry regional and world totals as columns, those are never ranked; World,
+# when present, is the total shares are taken of.
+TOTAL_COLUMN = "World"
+REGION_COLUMNS = frozenset(["World", "Africa", "Asia", "Central America", "Europe", "Middle East", "North America",
+                            "Oceania", "South America", "Bunkers", "Statistical Difference", "EU27", "EU28", "OECD",
+                            "Non-OECD", "Annex B", "Non-Annex B", "KP Annex B", "Non KP Annex B", "Non-KP Annex B"])
+REST_OF_WORLD = "Rest of world"
+
+
+def rankedValues(reshape, low, high):
+    totals = reshape.rangeTotals(low, high)
+    countryMask = ~np.isin(reshape.countries, list(REGION_COLUMNS))
+    totalIndex = np.flatnonzero(reshape.countries == TOTAL_COLUMN)
+    if len(totalIndex) and not np.isnan(totals[totalIndex[0]]):
+        total = float(totals[totalIndex[0]])
+    else:
+        total = float(np.nansum(totals[countryMask]))
+    countries, values = reshape.countries[countryMask], totals[countryMask]
+    present = ~np.isnan(values)
+    return countries[present], values[present], total
+
+
+def rankingFrame(countries, values, total, valueName):
+    share = values / total * 100 if total else np.full(len(values), np.nan)
+    return pd.DataFrame({'Country': countries, valueName: values, 'Share (%)': share})
+
+
+def pickCountries(values, n, largest=True):
+    n = min(max(n, 0), len(values))
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    keys = -values if largest else values
+    picked = np.argpartition(keys, n - 1)[:n] if n < len(values) else np.arange(len(values))
+    return picked[np.argsort(keys[picked], kind='stable')]
+
+
+def topCountries(reshape, low, high, n, valueName, withRest=True):
+    countries, values, total = rankedValues(reshape, low, high)
+    picked = pickCountries(values, n)
+    countries, topValues = countries[picked], values[picked]
+    if withRest and len(picked) < len(values):
+        # everything outside the top N, measured against the world total when the table has one
+        countries = np.append(countries, REST_OF_WORLD)
+        topValues = np.append(topValues, total - topValues.sum())
+    return rankingFrame(countries, topValues, total, valueName)
+
+
+def bottomCountries(reshape, low, high, n, valueName):
+    countries, values, total = rankedValues(reshape, low, high)
+    picked = pickCountries(values, n, largest=False)
+    return rankingFrame(countries[picked], values[picked], total, valueName)
+
+
+def allCountries(reshape, low, high, valueName):
+    # every column in table order, regions included, as the pages drew it before rankings
+    _, _, total = rankedValues(reshape, low, high)
+    return rankingFrame(reshape.countries, reshape.rangeTotals(low, high), total, valueName)
+
+
+def countriesAbovePercentile(reshape, low, high, percentile, valueName):
+    countries, values, total = rankedValues(reshape, low, high)
+    if not len(values):
+        return rankingFrame(countries, values, total, valueName)
+    threshold = np.percentile(values, percentile)
+    above = np.flatnonzero(values >= threshold)
+    above = above[np.argsort(-values[above], kind='stable')]
+    return rankingFrame(countries[above], values[above], total, valueName)
+#******************************************************************************************************************************
+# Null handling
+# One isna() pass per dataset gives per-column null counts and the rows holding a null, both cached.
+# Fill values are computed only for the columns that actually have nulls, and filling only replaces those
+# columns on a shallow copy, the untouched columns are shared with the loaded frame. A dataset without nulls
+# is handed back as it is, and every handled result is cached, so switching the selectbox never re-scans.
+NULL_HANDLING_OPTIONS = ["Remove Null", "Impute by Mode", "Impute by Median", "Impute by Type",
+                         "Forward Fill", "Linear Interpolation", "Keep Null"]
+
+
+class NullStats:
+    def __init__(self, data):
+        missing = data.isna()
+        self.nullCounts = missing.sum()
+        self.rowHasNull = missing.any(axis=1).to_numpy()
+        self.nullColumns = list(self.nullCounts.index[self.nullCounts.to_numpy() > 0])
+        self.dtypes = data.dtypes
+        self.fillValues = {}
+
+    def cacheBytes(self):
+        return int(self.rowHasNull.nbytes + self.nullCounts.memory_usage(deep=False))
+
+    def extended(self, appended, delta):
+        missing = delta.isna()
+        extended = object.__new__(NullStats)
+        extended.nullCounts = self.nullCounts + missing.sum()
+        extended.rowHasNull = np.concatenate([self.rowHasNull, missing.any(axis=1).to_numpy()])
+        extended.nullColumns = list(extended.nullCounts.index[extended.nullCounts.to_numpy() > 0])
+        extended.dtypes = appended.dtypes
+        # medians and modes move with every new row, they are recomputed on demand
+        extended.fillValues = {}
+        return extended
+
+    def isNumeric(self, column):
+        return pd.api.types.is_numeric_dtype(self.dtypes[column]) and not pd.api.types.is_bool_dtype(self.dtypes[column])
+
+    def fillValue(self, data, column, statistic):
+        key = (column, statistic)
+        if key not in self.fillValues:
+            series = data[column]
+            if statistic == "median":
+                value = series.median()
+            else:
+                modes = series.mode()
+                value = modes.iloc[0] if len(modes) else np.nan
+            self.fillValues[key] = value
+        return self.fillValues[key]
+
+    def columnStatistic(self, column, option):
+        if option == "Impute by Mode":
+            return "mode"
+        if option == "Impute by Median":
+            return "median" if self.isNumeric(column) else None
+        # by type: medians for numbers, the most frequent label for text and categories
+        return "median" if self.isNumeric(column) else "mode"
+
+
+def nullStats(data):
+    return cachedDerived(data, 'nullStats', lambda: NullStats(data))
+
+
+def fillColumns(data, stats, option):
+    handled = data.copy(deep=False)
+    for column in stats.nullColumns:
+        statistic = stats.columnStatistic(column, option)
+        if statistic is not None:
+            handled[column] = data[column].fillna(stats.fillValue(data, column, statistic))
+    return handled
+
+
+def alongYear(data, stats, option, yearColumn='Year'):
+    ordered = indexByYear(data, yearColumn).frame if yearColumn in data.columns else data
+    handled = ordered.copy(deep=False)
+    for column in stats.nullColumns:
+        if option == "Linear Interpolation" and stats.isNumeric(column):
+            handled[column] = ordered[column].interpolate(method='linear')
+        else:
+            handled[column] = ordered[column].ffill()
+    return handled
+
+
+def computeNullHandling(data, option):
+    stats = nullStats(data)
+    if option == "Keep Null" or not stats.nullColumns:
+        return data
+    if option == "Remove Null":
+        return data[~stats.rowHasNull]
+    if option in ("Forward Fill", "Linear Interpolation"):
+        return alongYear(data, stats, option)
+    return fillColumns(data, stats, option)
+
+
+def handleNulls(data, option):
+    # decided before the cache, a cached result is a copy and would never compare identical to the frame again
+    if option == "Keep Null" or not nullStats(data).nullColumns:
+        return data
+    key = datasetKey(data)
+    if key is None:
+        return computeNullHandling(data, option)
+    handled = derivedCache.getOrCompute((key, 'nullHandled', option), lambda: computeNullHandling(data, option))
+    return withDatasetKey(handled.copy(deep=False), f"{key}|{option}")
+#******************************************************************************************************************************
+# Data profile
+# Every section of the profile panel is computed on first request only and then kept with how long it took.
+# Null counts come from the same cached NullStats pass the null handling uses. The profile keeps its sections only,
+# the frame is handed in by the caller, so a cached profile never holds on to a dataset the loader cache let go.
+class DatasetProfile:
+    def __init__(self):
+        self.sections = {}
+        self.lock = threading.Lock()
+
+    def cacheBytes(self):
+        return sum(frameBytes(value) for value, _ in self.sections.values())
+
+    def computeSection(self, name, data):
+        if name == "head":
+            return data.head()
+        if name == "dtypes":
+            return data.dtypes
+        if name == "nullCounts":
+            return nullStats(data).nullCounts
+        if name == "minMax":
+            numeric = data.select_dtypes(include='number')
+            return pd.DataFrame({"min": numeric.min(), "max": numeric.max()})
+        if name == "memory":
+            usage = data.memory_usage(index=True, deep=True)
+            return pd.DataFrame({"bytes": usage, "MB": (usage / 1024**2).round(3)})
+        if name == "cardinality":
+            return data.nunique(dropna=True).rename("distinct values")
+        raise KeyError(name)
+
+    def section(self, name, data):
+        with self.lock:
+            if name not in self.sections:
+                started = time.perf_counter()
+                value = self.computeSection(name, data)
+                self.sections[name] = (value, time.perf_counter() - started)
+            return self.sections[name]
+
+
+def profileData(data):
+    return cachedDerived(data, 'profile', DatasetProfile)
+#******************************************************************************************************************************
+# Aggregate engine
+# Derived series over any numeric column in year order: running totals, rolling means, year-over-year changes
+# and decade totals. Rows are first summed to one value per calendar year and missing years are filled in as NaN,
+# so a window counts years and a change is always against the previous year, whatever the rows per year or the
+# rows a null option dropped. Each series is computed once per dataset, column and window and sliced by year
+# afterwards, an appended release only computes its own years.
+AGGREGATE_KINDS = ["Cumulative", "Rolling Mean", "Year-over-Year Change", "Decade Total"]
+
+
+class YearAggregate:
+    def __init__(self, data, column, kind, window=None, yearColumn='Year'):
+        yearData = indexByYear(data, yearColumn)
+        self.yearColumn = yearColumn
+        self.yearBounds = yearData.bounds() if yearData.validRows else None
+        self.column = column
+        self.kind = kind
+        self.window = window
+        if kind == "Decade Total":
+            self.totals = self.decadeTotals(yearData.frame)
+        else:
+            self.years, self.sums = self.yearlySums(yearData.frame.iloc[:yearData.validRows])
+            self.values = self.yearValues(self.sums)
+
+    def cacheBytes(self):
+        if self.kind == "Decade Total":
+            return int(self.totals.memory_usage(deep=False))
+        return self.years.nbytes + self.sums.nbytes + self.values.nbytes
+
+    def numeric(self, frame):
+        return pd.to_numeric(frame[self.column], errors='coerce').astype('float64')
+
+    def yearlySums(self, frame, first=None):
+        years = np.floor(frame[self.yearColumn].to_numpy(dtype='float64')).astype('int64')
+        sums = self.numeric(frame).groupby(years).sum(min_count=1)
+        if not len(sums):
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='float64')
+        allYears = np.arange(int(sums.index[0]) if first is None else first, int(sums.index[-1]) + 1)
+        return allYears, sums.reindex(allYears).to_numpy(dtype='float64', na_value=np.nan)
+
+    def yearValues(self, sums):
+        series = pd.Series(sums, dtype='float64')
+        if self.kind == "Cumulative":
+            series = series.cumsum()
+        elif self.kind == "Rolling Mean":
+            series = series.rolling(self.window, min_periods=1).mean()
+        elif self.kind == "Year-over-Year Change":
+            series = series.diff()
+        else:
+            raise KeyError(self.kind)
+        return series.to_numpy(dtype='float64', na_value=np.nan)
+
+    def decadeTotals(self, frame):
+        years = frame[self.yearColumn]
+        return self.numeric(frame).groupby((years // 10 * 10).rename('Decade')).sum()
+
+    def between(self, low, high, valueName):
+        if self.kind == "Decade Total":
+            totals = self.totals[(self.totals.index >= low // 10 * 10) & (self.totals.index <= high)]
+            return pd.DataFrame({'Decade': totals.index.to_numpy(), valueName: totals.to_numpy()})
+        start = int(np.searchsorted(self.years, low, side='left'))
+        stop = int(np.searchsorted(self.years, high, side='right'))
+        return pd.DataFrame({self.yearColumn: self.years[start:stop], valueName: self.values[start:stop]})
+
+    def frame(self, valueName):
+        return self.between(*self.yearBounds, valueName)
+
+    def extended(self, appended, delta):
+        extended = object.__new__(YearAggregate)
+        extended.yearColumn = self.yearColumn
+        extended.yearBounds = indexByYear(appended, self.yearColumn).bounds()
+        extended.column = self.column
+        extended.kind = self.kind
+        extended.window = self.window
+        if self.kind == "Decade Total":
+            extended.totals = self.totals.add(self.decadeTotals(delta), fill_value=0)
+            return extended
+        # the new years start right after the last known one, a gap between the releases stays NaN
+        newYears, newSums = self.yearlySums(delta, int(self.years[-1]) + 1 if len(self.years) else None)
+        extended.years = np.concatenate([self.years, newYears])
+        extended.sums = np.concatenate([self.sums, newSums])
+        known = len(self.sums)
+        if self.kind == "Cumulative":
+            # the running total is the last value that is not missing
+            finite = self.values[~np.isnan(self.values)]
+            newValues = self.yearValues(newSums) + (finite[-1] if len(finite) else 0.0)
+        else:
+            # the last years before the release are the window (or the previous year) of the first new years
+            seed = min(known, self.window - 1 if self.kind == "Rolling Mean" else 1)
+            newValues = self.yearValues(extended.sums[known - seed:])[seed:]
+        extended.values = np.concatenate([self.values, newValues])
+        return extended
+
+
+def aggregate(data, column, kind, window=None, yearColumn='Year'):
+    return cachedDerived(data, 'aggregate', lambda: YearAggregate(data, column, kind, window, yearColumn),
+                         column, kind, window, yearColumn)
+#******************************************************************************************************************************
+# Appending a new release
+# A release file holds only the new years. It is checked against the dataset's columns and types, added after
+# the last year and registered under a key derived from both files. Everything cached for the old dataset
+# that knows how to extend itself (year index, null statistics, country matrix, aggregates) is carried
+# over by reading the new rows only, the rest is recomputed the first time a page asks for it.
+HANDLED_APPENDS = ("Remove Null", "Forward Fill")
+
+
+def concatRows(frames):
+    frames = list(frames)
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            parts = shareCategories([frame[column] for frame in frames])
+            frames = [frame.assign(**{column: part}) for frame, part in zip(frames, parts)]
+    return pd.concat(frames)
+
+
+def conformDelta(data, delta, yearColumn='Year'):
+    extra = [str(column) for column in delta.columns if column not in data.columns]
+    if extra:
+        raise ValueError(f"columns not in the dataset: {', '.join(extra)}")
+    if yearColumn not in delta.columns:
+        raise ValueError(f"the new rows have no {yearColumn} column")
+    if delta[yearColumn].isna().any():
+        raise ValueError(f"some of the new rows have no {yearColumn}")
+    # columns the release leaves out are empty for the new years
+    delta = delta.reindex(columns=data.columns)
+    for column in data.columns:
+        target = data[column].dtype
+        if not pd.api.types.is_numeric_dtype(target) or pd.api.types.is_bool_dtype(target):
+            continue
+        try:
+            values = pd.to_numeric(delta[column])
+        except (TypeError, ValueError):
+            raise ValueError(f"column {column} is numeric in the dataset but not in the new rows")
+        if pd.api.types.is_float_dtype(target):
+            values = values.astype(target)
+        elif not values.isna().any():
+            # whole numbers keep the dataset's integer type, anything else lets the column widen
+            cast = values.astype(target)
+            values = cast if (cast == values).all() else values
+        delta[column] = values
+    return delta.sort_values(yearColumn, kind='stable', ignore_index=True)
+
+
+def migrateDerived(oldData, appended, delta):
+    oldKey = datasetKey(oldData)
+    # only a frame that was already in year order is a prefix of the appended one
+    if oldKey is None or indexByYear(oldData).resorted:
+        return
+    newKey = datasetKey(appended)
+    found = [(key, value) for key, value in derivedCache.items() if key[0] == oldKey and hasattr(value, "extended")]
+    # the year index first, the other artifacts slice the appended rows through it
+    found.sort(key=lambda item: item[0][1] != 'yearIndex')
+    for key, value in found:
+        derivedCache.put((newKey,) + key[1:], value.extended(appended, delta))
+
+
+def migrateHandled(oldData, appended, delta):
+    # dropping rows and carrying values forward only look backwards, the handled frames grow by the handled new rows
+    oldKey, newKey = datasetKey(oldData), datasetKey(appended)
+    if oldKey is None or indexByYear(oldData).resorted:
+        return
+    for option in HANDLED_APPENDS:
+        handled = derivedCache.get((oldKey, 'nullHandled', option))
+        if handled is None:
+            continue
+        if option == "Remove Null":
+            handledDelta = delta[~delta.isna().any(axis=1).to_numpy()]
+        else:
+            handledDelta = concatRows([handled.iloc[-1:], delta]).ffill().iloc[1:]
+        extended = derivedCache.put((newKey, 'nullHandled', option), concatRows([handled, handledDelta]))
+        migrateDerived(withDatasetKey(handled.copy(deep=False), f"{oldKey}|{option}"),
+                       withDatasetKey(extended.copy(deep=False), f"{newKey}|{option}"), handledDelta)
+
+
+def appendCsv(data, pathFile, yearColumn='Year'):
+    deltaHash = uploadHash(pathFile)
+    # the page already shows this release
+    if deltaHash in data.attrs.get('appendedDeltas', ()):
+        return data
+    if yearColumn not in data.columns:
+        raise ValueError(f"the dataset has no {yearColumn} column to append by")
+    oldKey = datasetKey(data)
+    key = None if oldKey is None else contentHash(f"{oldKey}+{deltaHash}".encode())
+    appended = None if key is None else loaderCache.get(key)
+    if appended is None:
+        delta = conformDelta(data, pd.read_csv(io.BytesIO(readUploadBytes(pathFile))), yearColumn)
+        if delta.empty:
+            raise ValueError("the file has no rows")
+        yearData = indexByYear(data, yearColumn)
+        if yearData.validRows and delta[yearColumn].iloc[0] <= yearData.years[-1]:
+            raise ValueError(f"the new rows start at {delta[yearColumn].iloc[0]} but the dataset already runs to "
+                             f"{int(yearData.years[-1])}, only later years can be appended")
+        # row labels continue the old ones, so handled frames match what handling the whole table gives
+        delta.index = pd.RangeIndex(len(data), len(data) + len(delta))
+        frame = yearData.frame
+        appended = concatRows([frame.iloc[:yearData.validRows], delta, frame.iloc[yearData.validRows:]])
+        appended.attrs = {**data.attrs, 'datasetKey': key, 'appendedDeltas': data.attrs.get('appendedDeltas', ()) + (deltaHash,)}
+        if key is not None:
+            migrateDerived(data, appended, delta)
+            migrateHandled(data, appended, delta)
+            loaderCache.put(key, appended)
+    return appended.copy(deep=False)
+#******************************************************************************************************************************
+# Session dataset registry
+# One per browser session. Every parsed upload is registered under a name, and any page whose required
+# columns it has can use it without a new upload. Pages hold a reference to the dataset they show; when
+# the registry is full, the least recently registered dataset that no page references is dropped.
+class DatasetRegistry:
+    def __init__(self, maxDatasets=SESSION_DATASETS):
+        self.maxDatasets = maxDatasets
+        self.datasets = OrderedDict()
+        self.bindings = {}
+
+    def register(self, name, data):
+        key = datasetKey(data)
+        for existingName, entry in self.datasets.items():
+            if key is not None and entry["key"] == key:
+                self.datasets.move_to_end(existingName)
+                return existingName
+        uniqueName, suffix = name, 2
+        while uniqueName in self.datasets:
+            uniqueName, suffix = f"{name} ({suffix})", suffix + 1
+        self.datasets[uniqueName] = {"data": data, "key": key, "columns": frozenset(data.columns)}
+        self.evictUnreferenced()
+        return uniqueName
+
+    def refCount(self, name):
+        return sum(1 for bound in self.bindings.values() if bound == name)
+
+    def bind(self, page, name):
+        if name is None:
+            self.bindings.pop(page, None)
+        elif name in self.datasets:
+            self.bindings[page] = name
+        self.evictUnreferenced()
+
+    def binding(self, page):
+        return self.bindings.get(page)
+
+    def get(self, name):
+        entry = self.datasets.get(name)
+        return None if entry is None else entry["data"].copy(deep=False)
+
+    def compatible(self, requiredColumns):
+        required = set(requiredColumns)
+        # newest first, that is usually the one that was just uploaded
+        return [name for name, entry in reversed(self.datasets.items()) if required <= entry["columns"]]
+
+    def evictUnreferenced(self):
+        for name in list(self.datasets):
+            if len(self.datasets) <= self.maxDatasets:
+                break
+            if self.refCount(name) == 0:
+                del self.datasets[name]
+
+    def forgetUnreferenced(self):
+        for name in list(self.datasets):
+            if self.refCount(name) == 0:
+                del self.datasets[name]
+
+    def summary(self):
+        rows = []
+        for name, entry in self.datasets.items():
+            pages = [page for page, bound in self.bindings.items() if bound == name]
+            rows.append({"Dataset": name, "Rows": len(entry["data"]), "Columns": len(entry["columns"]),
+                         "Used by": ", ".join(pages)})
+        return pd.DataFrame(rows, columns=["Dataset", "Rows", "Columns", "Used by"])
+#******************************************************************************************************************************
+# Global Carbon Budget workbook
+# The published workbook keeps one table per sheet under a block of notes, the national sheets also have an
+# empty first header cell above the years. Each sheet is parsed in its own process, so a whole workbook takes
+# about as long as its slowest sheet, and each sheet is cached like a CSV upload under hash:sheet.
+SHEET_PAGES = [("historical", "Historical Budget"), ("globalcarbonbudget", "Global Carbon Budget"),
+               ("fossil", "Fossil Emission"), ("landuse", "Land Use Change Emission"), ("ocean", "Ocean Sink"),
+               ("terrestrial", "Terrestrial Sink"), ("territorial", "Territorial Emission"),
+               ("consumption", "Consumption Emission"), ("transfer", "Emission Transfer"), ("cement", "Cement Carbon Emission")]
+
+
+def pageForSheet(sheetName):
+    normalized = re.sub(r"[^a-z]", "", sheetName.lower())
+    for keyword, page in SHEET_PAGES:
+        if keyword in normalized:
+            return page
+    return None
+
+
+def isYear(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return False
+    return number.is_integer() and 1700 <= number <= 2200
+
+
+def findHeaderRow(raw):
+    # the header is the first row with text in it that sits directly above a run of years in the first column
+    firstColumn = raw.iloc[:, 0].tolist()
+    for row in range(min(len(raw) - 1, HEADER_SEARCH_ROWS)):
+        cells = raw.iloc[row].dropna()
+        if len(cells) < 2 or not any(isinstance(cell, str) for cell in cells):
+            continue
+        following = [value for value in firstColumn[row + 1:row + 4] if not pd.isna(value)]
+        if following and all(isYear(value) for value in following):
+            return row
+    return None
+
+
+def tidySheet(raw):
+    raw = raw.dropna(axis=0, how='all').dropna(axis=1, how='all').reset_index(drop=True)
+    if raw.empty:
+        return raw
+    headerRow = findHeaderRow(raw)
+    if headerRow is None:
+        return pd.DataFrame()
+    header = []
+    for position, cell in enumerate(raw.iloc[headerRow]):
+        name = "Year" if position == 0 else (str(cell).strip() if not pd.isna(cell) else f"Unnamed: {position}")
+        header.append(name)
+    data = raw.iloc[headerRow + 1:].copy()
+    data.columns = header
+    data = data.loc[:, ~data.columns.duplicated()]
+    for column in data.columns:
+        converted = pd.to_numeric(data[column], errors='coerce')
+        if converted.notna().sum() >= 0.9 * data[column].notna().sum():
+            data[column] = converted
+    # footnotes below the table have no year
+    data = data[data['Year'].map(isYear)]
+    data['Year'] = data['Year'].astype('int64')
+    data = data.dropna(axis=1, how='all').reset_index(drop=True)
+    return data
+
+
+def parseWorkbookSheet(raw, sheetName):
+    # runs in a worker process
+    sheet = pd.read_excel(io.BytesIO(raw), sheet_name=sheetName, header=None)
+    return sheetName, tidySheet(sheet)
+
+
+def workbookSheetNames(raw):
+    with pd.ExcelFile(io.BytesIO(raw)) as workbook:
+        return list(workbook.sheet_names)
+
+
+def parseWorkbookSheets(raw, sheetNames, progress=None):
+    parsed = {}
+    workers = min(len(sheetNames), WORKBOOK_WORKERS)
+    if workers > 1:
+        try:
+            # spawn, forking a threaded Streamlit server is not safe
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [pool.submit(parseWorkbookSheet, raw, name) for name in sheetNames]
+                for future in as_completed(futures):
+                    name, data = future.result()
+                    parsed[name] = data
+                    if progress is not None:
+                        progress(len(parsed) / len(sheetNames))
+            return parsed
+        except (OSError, NotImplementedError, RuntimeError):
+            parsed = {}
+    for name in sheetNames:
+        parsed[name] = parseWorkbookSheet(raw, name)[1]
+        if progress is not None:
+            progress(len(parsed) / len(sheetNames))
+    return parsed
+
+
+def loadWorkbook(pathFile, progress=None):
+    workbookKey = uploadHash(pathFile)
+    sheetNames = loaderCache.get(workbookKey)
+    if sheetNames is None:
+        sheetNames = workbookSheetNames(readUploadBytes(pathFile))
+        loaderCache.put(workbookKey, sheetNames)
+    sheets, missing = OrderedDict(), []
+    for name in sheetNames:
+        key = f"{workbookKey}:{name}"
+        data = loaderCache.get(key)
+        if data is None:
+            data = diskCache.load(key)
+            if data is not None:
+                loaderCache.put(key, withDatasetKey(data, key))
+        if data is None:
+            missing.append(name)
+        sheets[name] = data
+    if missing:
+        for name, data in parseWorkbookSheets(readUploadBytes(pathFile), missing, progress).items():
+            key = f"{workbookKey}:{name}"
+            if not data.empty:
+                diskCache.store(key, data)
+            sheets[name] = loaderCache.put(key, withDatasetKey(data, key))
+    # sheets without a recognizable table (notes, summaries) are left out
+    return workbookKey, OrderedDict((name, data.copy(deep=False)) for name, data in sheets.items() if not data.empty)
+
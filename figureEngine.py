@@ -0,0 +1,229 @@
+#Libraries
+import importlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+import pandas as pd
+
+import dataEngine
+#******************************************************************************************************************************
+# Lazy imports
+# app.py runs top to bottom on every rerun, a module it only needs for charts is imported on first attribute access.
+class LazyModule:
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+#******************************************************************************************************************************
+# Downsampling
+# Time series are thinned on the server before a figure is built, so the browser never receives more points
+# than it can draw. Both methods keep the first and last point and the visual shape of the series:
+# LTTB keeps the points spanning the largest triangles, min/max keeps each bucket's extremes (spikes survive).
+DOWNSAMPLE_METHODS = ["LTTB", "Min/Max"]
+
+
+def bucketEdges(length, buckets):
+    # interior points only, the first and last point are always kept
+    return np.linspace(1, length - 1, buckets + 1).astype(np.int64)
+
+
+def lttbIndices(x, y, threshold):
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+    edges = bucketEdges(length, threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = length - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        if stop <= start:
+            stop = start + 1
+        # the next bucket's average is the third corner of the triangle
+        nextStart, nextStop = edges[bucket + 1], edges[bucket + 2] if bucket + 2 < len(edges) else length
+        if nextStop <= nextStart:
+            nextStop = nextStart + 1
+        avgX = x[nextStart:nextStop].mean()
+        avgY = y[nextStart:nextStop].mean()
+        areas = np.abs((x[previous] - avgX) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (avgY - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minMaxIndices(y, threshold):
+    length = len(y)
+    if threshold >= length or threshold < 4:
+        return np.arange(length)
+    edges = bucketEdges(length, (threshold - 2) // 2)
+    selected = [0]
+    for start, stop in zip(edges[:-1], edges[1:]):
+        if stop <= start:
+            continue
+        bucket = y[start:stop]
+        selected.append(start + int(np.argmin(bucket)))
+        selected.append(start + int(np.argmax(bucket)))
+    selected.append(length - 1)
+    return np.unique(selected)
+
+
+def downsampleFrame(data, x, y, maxPoints, method="LTTB"):
+    columns = [y] if isinstance(y, str) else list(y)
+    if not columns or len(data) <= maxPoints:
+        return data, 0
+    xValues = pd.to_numeric(data[x], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    xValues = np.nan_to_num(xValues, nan=np.nanmin(xValues) if np.isfinite(xValues).any() else 0.0)
+    # with several traces each gets its own points, the union keeps every trace on a shared x axis
+    perTrace = max(maxPoints // len(columns), 4)
+    keep = []
+    for column in columns:
+        yValues = pd.to_numeric(data[column], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        yValues = np.nan_to_num(yValues, nan=0.0)
+        if method == "Min/Max":
+            keep.append(minMaxIndices(yValues, perTrace))
+        else:
+            keep.append(lttbIndices(xValues, yValues, perTrace))
+    rows = np.unique(np.concatenate(keep))
+    return data.iloc[rows], len(data) - len(rows)
+#******************************************************************************************************************************
+# Compact figure data
+# Plotly writes numpy arrays into the figure JSON as base64 typed arrays, so the narrower the dtype the fewer
+# bytes Streamlit sends on every rerun. Float traces go to float32 (about 7 significant digits, more than a
+# chart can show) and float arrays holding only whole numbers, such as years, to the smallest integer type.
+TRACE_ARRAYS = ("x", "y", "z", "customdata")
+MARKER_ARRAYS = ("size", "color")
+
+
+def compactArray(values):
+    if not isinstance(values, np.ndarray) or values.dtype.kind != 'f' or not len(values):
+        return None
+    if np.isfinite(values).all() and np.array_equal(values, np.round(values)):
+        low, high = values.min(), values.max()
+        for dtype in (np.int8, np.int16, np.int32):
+            if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+                return values.astype(dtype)
+    return None if values.dtype == np.float32 else values.astype(np.float32)
+
+
+def compactFigure(fig):
+    for trace in fig.data:
+        parts = [(trace, name) for name in TRACE_ARRAYS if name in trace]
+        if "marker" in trace:
+            parts += [(trace.marker, name) for name in MARKER_ARRAYS if name in trace.marker]
+        for owner, name in parts:
+            compact = compactArray(owner[name])
+            if compact is not None:
+                # plotly skips an assignment that compares equal, whatever the dtype
+                owner[name] = None
+                owner[name] = compact
+    return fig
+#******************************************************************************************************************************
+# Figure cache
+# A figure is keyed by the dataset it was drawn from, the page, its name on that page and only the widget
+# values it depends on. A rerun triggered by some other widget gets the figure back without running px.* again.
+# Entries are sized by the trace arrays they hold and capped in MB like the loader and derived caches.
+FIGURE_CACHE_ENTRIES = int(os.environ.get("CARBON_FIGURE_CACHE_ENTRIES", "128"))
+FIGURE_CACHE_MB = int(os.environ.get("CARBON_FIGURE_CACHE_MB", "512"))
+
+
+def arrayBytes(values):
+    if values is None or isinstance(values, str):
+        return 0
+    values = np.asarray(values)
+    if values.dtype == object:
+        return int(pd.Series(values.ravel()).memory_usage(index=False, deep=True))
+    return int(values.nbytes)
+
+
+def figureBytes(value):
+    # app.py caches (figure, notes) pairs, the geojson of a map is shared with the geometry cache and not counted
+    fig = value[0] if isinstance(value, tuple) else value
+    total = 0
+    for trace in getattr(fig, "data", ()):
+        total += sum(arrayBytes(trace[name]) for name in TRACE_ARRAYS + ("locations", "text") if name in trace)
+        if "marker" in trace:
+            total += sum(arrayBytes(trace.marker[name]) for name in MARKER_ARRAYS if name in trace.marker)
+    return total
+
+
+figureCache = dataEngine.LruCache(FIGURE_CACHE_ENTRIES, FIGURE_CACHE_MB * 1024 * 1024, sizeOf=figureBytes)
+
+
+def figureKey(datasetKey, page, name, deps):
+    return None if datasetKey is None else (datasetKey, page, name) + tuple(deps)
+
+
+def cachedFigure(datasetKey, page, name, deps, build):
+    key = figureKey(datasetKey, page, name, deps)
+    if key is None:
+        return build()
+    return figureCache.getOrCompute(key, build)
+#******************************************************************************************************************************
+# Concurrent figure builds
+# The independent figures of a page are built on one bounded thread pool shared by all sessions, threads because
+# figures and frames would have to be pickled for a process pool. Every figure gets its own deadline counted from
+# submission, so a page waits about as long as its slowest figure. A figure past its deadline keeps building and
+# lands in the figure cache for the next rerun, a figure that fails only takes its own chart down. A figure still
+# building is shared: later reruns (of any session) wait on the same build instead of queueing another copy of it.
+FIGURE_WORKERS = int(os.environ.get("CARBON_FIGURE_WORKERS", str(min(4, os.cpu_count() or 1))))
+FIGURE_TIMEOUT_S = float(os.environ.get("CARBON_FIGURE_TIMEOUT_S", "30"))
+poolLock = threading.Lock()
+figurePool = None
+pendingLock = threading.Lock()
+pendingFigures = {}
+
+
+def figureExecutor():
+    global figurePool
+    with poolLock:
+        if figurePool is None:
+            figurePool = ThreadPoolExecutor(max_workers=FIGURE_WORKERS, thread_name_prefix="figure")
+        return figurePool
+
+
+def submitFigure(job, key=None):
+    # a cached figure is a dictionary lookup, it is answered right here instead of queueing behind real builds
+    if key is not None and key in figureCache:
+        future = Future()
+        try:
+            future.set_result(job())
+        except Exception as exc:
+            future.set_exception(exc)
+        return future, time.monotonic()
+    if key is None:
+        return figureExecutor().submit(job), time.monotonic() + FIGURE_TIMEOUT_S
+    with pendingLock:
+        future = pendingFigures.get(key)
+        submitted = future is None
+        if submitted:
+            future = pendingFigures[key] = figureExecutor().submit(job)
+    if submitted:
+        # outside the lock, a build that is already done runs the callback right here
+        future.add_done_callback(lambda done: dropPending(key, done))
+    return future, time.monotonic() + FIGURE_TIMEOUT_S
+
+
+def dropPending(key, future):
+    with pendingLock:
+        if pendingFigures.get(key) is future:
+            del pendingFigures[key]
+
+
+def collectFigure(future, deadline):
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0)), None
+    except FutureTimeoutError:
+        return None, f"still building after {FIGURE_TIMEOUT_S:g} s, it shows up on the next rerun once it is done"
+    except Exception as exc:
+        return None, f"{type(exc).__name__}: {exc}"
+
@@ -0,0 +1,237 @@
+#Libraries
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+import dataEngine
+#******************************************************************************************************************************
+# Settings
+# Country outlines come from any file geopandas can read (Natural Earth admin 0, GADM level 0, ...) named in
+# CARBON_COUNTRY_GEOMETRIES. Without one, maps use the world outlines built into plotly, located by ISO code.
+GEOMETRY_PATH = os.environ.get("CARBON_COUNTRY_GEOMETRIES")
+GEOMETRY_CACHE_DIR = os.path.join(dataEngine.DISK_CACHE_DIR, "geometries")
+# simplification tolerance in degrees for every map detail level
+MAP_DETAIL = {"Detailed": 0.01, "Medium": 0.05, "Coarse": 0.25}
+ISO_COLUMNS = ["ISO_A3_EH", "ISO_A3", "ADM0_A3", "ISO3", "GID_0", "iso_a3", "iso3", "ISO"]
+NAME_COLUMNS = ["NAME", "NAME_LONG", "ADMIN", "NAME_EN", "FORMAL_EN", "SOVEREIGNT", "COUNTRY", "name", "admin", "NAME_0"]
+#******************************************************************************************************************************
+# Country name -> ISO 3166 alpha-3
+# The Global Carbon Budget national sheets name countries their own way ("USA", "Occupied Palestinian Territory",
+# "Democratic Republic of the Congo"). Names are compared after dropping accents, case and punctuation.
+COUNTRY_NAMES = {
+    "AFG": "Afghanistan", "ALB": "Albania", "DZA": "Algeria", "AND": "Andorra", "AGO": "Angola", "AIA": "Anguilla",
+    "ATG": "Antigua and Barbuda", "ARG": "Argentina", "ARM": "Armenia", "ABW": "Aruba", "AUS": "Australia",
+    "AUT": "Austria", "AZE": "Azerbaijan", "BHS": "Bahamas|The Bahamas", "BHR": "Bahrain", "BGD": "Bangladesh",
+    "BRB": "Barbados", "BLR": "Belarus", "BEL": "Belgium", "BLZ": "Belize", "BEN": "Benin", "BMU": "Bermuda",
+    "BTN": "Bhutan", "BOL": "Bolivia|Bolivia (Plurinational State of)", "BES": "Bonaire, Saint Eustatius and Saba",
+    "BIH": "Bosnia and Herzegovina", "BWA": "Botswana", "BRA": "Brazil", "VGB": "British Virgin Islands",
+    "BRN": "Brunei Darussalam|Brunei", "BGR": "Bulgaria", "BFA": "Burkina Faso", "BDI": "Burundi",
+    "KHM": "Cambodia", "CMR": "Cameroon", "CAN": "Canada", "CPV": "Cape Verde|Cabo Verde",
+    "CAF": "Central African Republic", "TCD": "Chad", "CHL": "Chile", "CHN": "China", "COL": "Colombia",
+    "COM": "Comoros", "COG": "Congo|Republic of the Congo|Congo, Rep.", "COK": "Cook Islands", "CRI": "Costa Rica",
+    "CIV": "Côte d'Ivoire|Cote d'Ivoire|Ivory Coast", "HRV": "Croatia", "CUB": "Cuba", "CUW": "Curaçao",
+    "CYP": "Cyprus", "CZE": "Czechia|Czech Republic", "PRK": "North Korea|Korea, Dem. Rep.|Democratic People's Republic of Korea",
+    "COD": "Democratic Republic of the Congo|Congo, Dem. Rep.|DR Congo", "DNK": "Denmark", "DJI": "Djibouti",
+    "DMA": "Dominica", "DOM": "Dominican Republic", "ECU": "Ecuador", "EGY": "Egypt", "SLV": "El Salvador",
+    "GNQ": "Equatorial Guinea", "ERI": "Eritrea", "EST": "Estonia", "SWZ": "Eswatini|Swaziland", "ETH": "Ethiopia",
+    "FRO": "Faeroe Islands|Faroe Islands", "FJI": "Fiji", "FIN": "Finland", "FRA": "France",
+    "PYF": "French Polynesia", "GAB": "Gabon", "GMB": "Gambia|The Gambia", "GEO": "Georgia", "DEU": "Germany",
+    "GHA": "Ghana", "GRC": "Greece", "GRL": "Greenland", "GRD": "Grenada", "GTM": "Guatemala", "GIN": "Guinea",
+    "GNB": "Guinea-Bissau", "GUY": "Guyana", "HTI": "Haiti", "HND": "Honduras", "HKG": "Hong Kong|Hong Kong, China",
+    "HUN": "Hungary", "ISL": "Iceland", "IND": "India", "IDN": "Indonesia", "IRN": "Iran|Iran (Islamic Republic of)",
+    "IRQ": "Iraq", "IRL": "Ireland", "ISR": "Israel", "ITA": "Italy", "JAM": "Jamaica", "JPN": "Japan",
+    "JOR": "Jordan", "KAZ": "Kazakhstan", "KEN": "Kenya", "KIR": "Kiribati", "XKX": "Kosovo", "KWT": "Kuwait",
+    "KGZ": "Kyrgyzstan", "LAO": "Laos|Lao People's Democratic Republic", "LVA": "Latvia", "LBN": "Lebanon",
+    "LSO": "Lesotho", "LBR": "Liberia", "LBY": "Libya", "LIE": "Liechtenstein", "LTU": "Lithuania",
+    "LUX": "Luxembourg", "MAC": "Macao|Macau", "MDG": "Madagascar", "MWI": "Malawi", "MYS": "Malaysia",
+    "MDV": "Maldives", "MLI": "Mali", "MLT": "Malta", "MHL": "Marshall Islands", "MRT": "Mauritania",
+    "MUS": "Mauritius", "MEX": "Mexico", "FSM": "Micronesia (Federated States of)|Micronesia", "MDA": "Moldova|Republic of Moldova",
+    "MNG": "Mongolia", "MNE": "Montenegro", "MSR": "Montserrat", "MAR": "Morocco", "MOZ": "Mozambique",
+    "MMR": "Myanmar|Burma", "NAM": "Namibia", "NRU": "Nauru", "NPL": "Nepal", "NLD": "Netherlands",
+    "NCL": "New Caledonia", "NZL": "New Zealand", "NIC": "Nicaragua", "NER": "Niger", "NGA": "Nigeria",
+    "NIU": "Niue", "MKD": "North Macedonia|Macedonia", "NOR": "Norway",
+    "PSE": "Occupied Palestinian Territory|Palestine|State of Palestine|West Bank and Gaza", "OMN": "Oman",
+    "PAK": "Pakistan", "PLW": "Palau", "PAN": "Panama", "PNG": "Papua New Guinea", "PRY": "Paraguay", "PER": "Peru",
+    "PHL": "Philippines", "POL": "Poland", "PRT": "Portugal", "QAT": "Qatar", "ROU": "Romania",
+    "RUS": "Russia|Russian Federation", "RWA": "Rwanda", "SHN": "Saint Helena", "KNA": "Saint Kitts and Nevis",
+    "LCA": "Saint Lucia", "SPM": "Saint Pierre and Miquelon", "VCT": "Saint Vincent and the Grenadines",
+    "WSM": "Samoa", "STP": "Sao Tome and Principe", "SAU": "Saudi Arabia", "SEN": "Senegal", "SRB": "Serbia",
+    "SYC": "Seychelles", "SLE": "Sierra Leone", "SGP": "Singapore", "SXM": "Sint Maarten (Dutch part)|Sint Maarten",
+    "SVK": "Slovakia|Slovak Republic", "SVN": "Slovenia", "SLB": "Solomon Islands", "SOM": "Somalia",
+    "ZAF": "South Africa", "KOR": "South Korea|Korea, Rep.|Republic of Korea", "SSD": "South Sudan", "ESP": "Spain",
+    "LKA": "Sri Lanka", "SDN": "Sudan", "SUR": "Suriname", "SWE": "Sweden", "CHE": "Switzerland",
+    "SYR": "Syria|Syrian Arab Republic", "TWN": "Taiwan", "TJK": "Tajikistan", "TZA": "Tanzania|United Republic of Tanzania",
+    "THA": "Thailand", "TLS": "Timor-Leste|East Timor", "TGO": "Togo", "TON": "Tonga", "TTO": "Trinidad and Tobago",
+    "TUN": "Tunisia", "TUR": "Turkey|Türkiye", "TKM": "Turkmenistan", "TCA": "Turks and Caicos Islands",
+    "TUV": "Tuvalu", "UGA": "Uganda", "UKR": "Ukraine", "ARE": "United Arab Emirates",
+    "GBR": "United Kingdom|UK", "USA": "USA|United States|United States of America", "URY": "Uruguay",
+    "UZB": "Uzbekistan", "VUT": "Vanuatu", "VEN": "Venezuela|Venezuela (Bolivarian Republic of)",
+    "VNM": "Viet Nam|Vietnam", "WLF": "Wallis and Futuna Islands|Wallis and Futuna", "YEM": "Yemen|Yemen, Rep.",
+    "ZMB": "Zambia", "ZWE": "Zimbabwe",
+}
+
+
+def normalizeName(name):
+    text = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode().lower()
+    return re.sub(r"[^a-z0-9]+", " ", text.replace("&", " and ")).strip()
+
+
+nameIndexLock = threading.Lock()
+nameIndexCache = {}
+
+
+def nameIndex():
+    with nameIndexLock:
+        if not nameIndexCache:
+            for code, names in COUNTRY_NAMES.items():
+                nameIndexCache[normalizeName(code)] = code
+                for name in names.split("|"):
+                    nameIndexCache[normalizeName(name)] = code
+        index = dict(nameIndexCache)
+    geometries = countryGeometries()
+    if geometries is not None:
+        # the outline file's own names fill in anything the table above misses
+        for name, code in geometries.names.items():
+            index.setdefault(name, code)
+    return index
+
+
+class CountryCodes:
+    # one ISO code per country column, joined once per dataset and reused for every year
+    def __init__(self, countries):
+        index = nameIndex()
+        self.countries = np.asarray(list(countries), dtype=object)
+        self.codes = np.array([index.get(normalizeName(country)) for country in self.countries], dtype=object)
+        self.matched = np.flatnonzero(pd.notna(self.codes))
+
+    def cacheBytes(self):
+        return self.codes.nbytes + self.countries.nbytes
+
+    def unmatched(self):
+        missing = np.flatnonzero(pd.isna(self.codes))
+        return [country for country in self.countries[missing] if country not in dataEngine.REGION_COLUMNS]
+
+    def extended(self, appended, delta):
+        # appending rows never changes the columns
+        return self
+
+
+def countryCodes(data, countryColumns):
+    return dataEngine.cachedDerived(data, 'countryCodes', lambda: CountryCodes(countryColumns),
+                                    dataEngine.columnsKey(countryColumns))
+#******************************************************************************************************************************
+# Country outlines
+# Read once per server process: reprojected to longitude/latitude, one row per ISO code, simplified at every
+# MAP_DETAIL tolerance and written as GeoParquet next to the upload cache. A restart reads those files back
+# without touching the source, and each detail level is turned into plotly GeoJSON once and then reused,
+# so a new year on the map only sends new colors.
+def importGeopandas():
+    try:
+        import geopandas
+    except ImportError as exc:
+        raise ImportError(f"country outlines need geopandas ({exc})") from exc
+    return geopandas
+
+
+def isoColumn(frame):
+    for column in ISO_COLUMNS:
+        if column in frame.columns:
+            return column
+    raise ValueError(f"no ISO code column ({', '.join(ISO_COLUMNS)}) in the country outline file")
+
+
+class CountryGeometries:
+    def __init__(self, path):
+        self.path = path
+        self.key = dataEngine.fileKey(path)
+        self.layers = {}
+        self.geojsons = {}
+        self.names = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def cachePath(self, name):
+        return os.path.join(GEOMETRY_CACHE_DIR, f"{self.key}-{name}.parquet")
+
+    def load(self):
+        gpd = importGeopandas()
+        paths = {detail: self.cachePath(detail) for detail in MAP_DETAIL}
+        namesPath = self.cachePath("names")
+        if all(os.path.exists(path) for path in list(paths.values()) + [namesPath]):
+            for detail, path in paths.items():
+                self.layers[detail] = gpd.read_parquet(path)
+            names = pd.read_parquet(namesPath)
+        else:
+            layers, names = self.build(gpd)
+            self.layers = layers
+            try:
+                os.makedirs(GEOMETRY_CACHE_DIR, exist_ok=True)
+                for detail, layer in layers.items():
+                    layer.to_parquet(paths[detail])
+                names.to_parquet(namesPath)
+            except (ImportError, OSError):
+                pass  # without pyarrow or a writable cache the outlines are simplified again next start
+        self.names = dict(zip(names["name"], names["code"]))
+
+    def build(self, gpd):
+        source = gpd.read_file(self.path)
+        if source.crs is not None:
+            source = source.to_crs(4326)
+        codeColumn = isoColumn(source)
+        source = source[source[codeColumn].astype(str).str.fullmatch(r"[A-Z]{3}")]
+        rows = []
+        for column in NAME_COLUMNS:
+            if column in source.columns:
+                rows.extend((normalizeName(name), code) for name, code in zip(source[column], source[codeColumn]) if pd.notna(name))
+        names = pd.DataFrame(rows, columns=["name", "code"]).drop_duplicates("name")
+        # countries split over several rows (overseas parts) become one shape, broken rings are repaired first
+        base = source[[codeColumn]].set_geometry(source.geometry.make_valid()).dissolve(by=codeColumn)
+        layers = {}
+        for detail, tolerance in MAP_DETAIL.items():
+            layer = base.copy()
+            layer["geometry"] = base.geometry.simplify(tolerance, preserve_topology=True)
+            layers[detail] = layer
+        return layers, names
+
+    def geojson(self, detail):
+        with self.lock:
+            if detail not in self.geojsons:
+                # feature ids are the ISO codes (the index), no properties are sent
+                self.geojsons[detail] = self.layers[detail][["geometry"]].to_geo_dict(drop_id=False)
+            return self.geojsons[detail]
+
+
+geometriesLock = threading.Lock()
+geometriesCache = {}
+
+
+def countryGeometries():
+    if not GEOMETRY_PATH:
+        return None
+    with geometriesLock:
+        if GEOMETRY_PATH not in geometriesCache:
+            geometriesCache[GEOMETRY_PATH] = CountryGeometries(GEOMETRY_PATH)
+        return geometriesCache[GEOMETRY_PATH]
+#******************************************************************************************************************************
+# Choropleth
+def mapValues(codes, reshape, low, high):
+    totals = reshape.rangeTotals(low, high)
+    return codes.codes[codes.matched], codes.countries[codes.matched], totals[codes.matched]
+
+
+def choropleth(locations, names, values, valueName, title, detail="Medium"):
+    import plotly.graph_objects as go
+    geometries = countryGeometries()
+    if geometries is None:
+        trace = go.Choropleth(locations=locations, locationmode="ISO-3", z=values, text=names)
+    else:
+        trace = go.Choropleth(geojson=geometries.geojson(detail), featureidkey="id", locations=locations, z=values, text=names)
+    trace.update(colorbar_title=valueName, hovertemplate="%{text}: %{z:,.2f}<extra></extra>")
+    fig = go.Figure(trace)
+    fig.update_geos(showframe=False, projection_type="natural earth", fitbounds="locations" if geometries is not None else False)
+    fig.update_layout(title=title, margin={"l": 0, "r": 0, "t": 40, "b": 0})
+    return fig
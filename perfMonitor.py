@@ -0,0 +1,138 @@
+#Libraries
+import json
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+#******************************************************************************************************************************
+# Rerun instrumentation
+# One recorder per Streamlit rerun. Pages wrap their stages (load, null handling, reshape, figure build,
+# chart render) in recorder.stage(name); each stage records wall time and, when asked for, the peak
+# Python memory allocated inside it (tracemalloc) and the bytes of chart JSON sent to the browser.
+PERF_LOG_PATH = os.environ.get("CARBON_PERF_LOG", "perf_log.jsonl")
+#******************************************************************************************************************************
+# Process-wide tracing
+# tracemalloc is one tracer for the whole process while Streamlit runs sessions on parallel threads. Tracing stays on
+# while any rerun tracks memory (counted, a rerun that never finishes gives its count back when it is collected),
+# and tracked stages take turns so one session's reset_peak cannot wipe the peak of another's stage.
+tracingLock = threading.Lock()
+tracingUsers = 0
+ownsTracing = False
+trackedStageLock = threading.RLock()
+
+
+def acquireTracing():
+    global tracingUsers, ownsTracing
+    with tracingLock:
+        if tracingUsers == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            ownsTracing = True
+        tracingUsers += 1
+
+
+def releaseTracing():
+    global tracingUsers, ownsTracing
+    with tracingLock:
+        tracingUsers -= 1
+        if tracingUsers == 0 and ownsTracing:
+            tracemalloc.stop()
+            ownsTracing = False
+#******************************************************************************************************************************
+# Recorder
+# A stage opened inside another one (a year slice first built during a figure build) records its parent. The parent's
+# time and peak include it, so totals subtract nested stages instead of counting them twice.
+class RerunRecorder:
+    def __init__(self, page, trackMemory=False):
+        self.page = page
+        self.trackMemory = trackMemory
+        self.startedAt = time.time()
+        self.started = time.perf_counter()
+        self.stages = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.tracing = None
+        if trackMemory:
+            acquireTracing()
+            self.tracing = weakref.finalize(self, releaseTracing)
+
+    def openStages(self):
+        # per thread, figure workers open their stages next to the script thread's
+        if not hasattr(self.local, "stages"):
+            self.local.stages = []
+        return self.local.stages
+
+    @contextmanager
+    def stage(self, name):
+        record = {"stage": name}
+        openStages = self.openStages()
+        if openStages:
+            record["parent"] = openStages[-1]["record"]["stage"]
+        entry = {"record": record, "baseline": 0, "peak": 0}
+        openStages.append(entry)
+        try:
+            if not self.trackMemory:
+                with self.timedStage(record):
+                    yield record
+                return
+            with trackedStageLock:
+                for outer in openStages[:-1]:
+                    # reset_peak drops the peak the enclosing stages have reached so far, they keep it here
+                    outer["peak"] = max(outer["peak"], tracemalloc.get_traced_memory()[1] - outer["baseline"])
+                tracemalloc.reset_peak()
+                entry["baseline"] = tracemalloc.get_traced_memory()[0]
+                with self.timedStage(record):
+                    try:
+                        yield record
+                    finally:
+                        record["peakBytes"] = max(entry["peak"], tracemalloc.get_traced_memory()[1] - entry["baseline"], 0)
+        finally:
+            openStages.pop()
+
+    @contextmanager
+    def timedStage(self, record):
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - started
+            with self.lock:
+                self.stages.append(record)
+
+    def finish(self):
+        if self.tracing is not None:
+            self.tracing()
+        with self.lock:
+            stages = list(self.stages)
+        return {"page": self.page, "startedAt": self.startedAt,
+                "totalSeconds": time.perf_counter() - self.started, "stages": stages}
+
+
+def appendJsonl(path, record):
+    with open(path, "a", encoding="utf-8") as handle:
+        handle.write(json.dumps(record) + "\n")
+
+
+def stageTable(record):
+    rows = []
+    for stage in record["stages"]:
+        name = stage["stage"] if "parent" not in stage else f"{stage['stage']} (in {stage['parent']})"
+        rows.append({"Stage": name, "ms": round(stage["seconds"] * 1000, 2),
+                     "Peak MB": round(stage["peakBytes"] / 1024**2, 2) if "peakBytes" in stage else None,
+                     "Payload KB": round(stage["payloadBytes"] / 1024, 1) if "payloadBytes" in stage else None})
+    return rows
+
+
+def pageSummary(history):
+    pages = {}
+    for record in history:
+        summary = pages.setdefault(record["page"], {"Page": record["page"], "Reruns": 0, "totalSeconds": 0.0, "Worst ms": 0.0})
+        summary["Reruns"] += 1
+        summary["totalSeconds"] += record["totalSeconds"]
+        summary["Worst ms"] = max(summary["Worst ms"], round(record["totalSeconds"] * 1000, 1))
+    rows = []
+    for summary in pages.values():
+        rows.append({"Page": summary["Page"], "Reruns": summary["Reruns"],
+                     "Mean ms": round(summary["totalSeconds"] / summary["Reruns"] * 1000, 1), "Worst ms": summary["Worst ms"]})
+    return rows
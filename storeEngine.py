@@ -0,0 +1,283 @@
+#Libraries
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import dataEngine
+#******************************************************************************************************************************
+# Settings
+# Out-of-core mode keeps an upload on disk as an Arrow IPC file cut into record batches of about STORE_BLOCK_MB of
+# CSV text and memory-maps it. The mode is aggregate-only: pages never hold the rows themselves, only the one row
+# per year reduced from them. Stores are evicted least recently used first once they pass STORE_MB on disk.
+STORE_DIR = os.path.join(dataEngine.DISK_CACHE_DIR, "stores")
+STORE_MB = int(os.environ.get("CARBON_STORE_MB", "16384"))
+STORE_BLOCK_MB = int(os.environ.get("CARBON_STORE_BLOCK_MB", "16"))
+OUT_OF_CORE_THRESHOLD_MB = int(os.environ.get("CARBON_OUT_OF_CORE_THRESHOLD_MB", "512"))
+STORE_ENTRIES = 8
+YEARLY_REDUCTIONS = ["Mean", "Sum"]
+#******************************************************************************************************************************
+# Sources
+# Files on disk are keyed by path, size and mtime so a multi-GB extract is never read just to hash it,
+# uploads are already in memory and are keyed by content like every other upload.
+def importArrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.csv
+        import pyarrow.ipc
+    except ImportError as exc:
+        raise ImportError(f"out-of-core mode needs pyarrow ({exc})") from exc
+    return pyarrow
+
+
+def isPath(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def wantsStore(source):
+    return dataEngine.uploadSize(source) > OUT_OF_CORE_THRESHOLD_MB * 1024 * 1024
+
+
+def uploadBuffer(source):
+    # a view of the upload's own buffer, a second multi-GB copy of the upload is exactly what this mode avoids
+    if hasattr(source, "getbuffer"):
+        return source.getbuffer()
+    return dataEngine.readUploadBytes(source)
+
+
+def sourceKey(source):
+    if isPath(source):
+        return dataEngine.fileKey(source)
+    return dataEngine.uploadHash(source, uploadBuffer)
+#******************************************************************************************************************************
+# Writing a store
+# The CSV is converted block by block, only one block is ever in memory. Types are fixed from the first block:
+# integer and empty value columns are read as float64 so a later block with decimals cannot break the read.
+# Next to the file a small manifest keeps the row count, null counts and min/max per column,
+# so the profile never scans the data for them.
+def isNumericType(pa, dataType):
+    return pa.types.is_integer(dataType) or pa.types.is_floating(dataType)
+
+
+def writeStore(pa, openSource, path, yearColumn, totalBytes, progress=None):
+    readOptions = pa.csv.ReadOptions(block_size=STORE_BLOCK_MB * 1024 * 1024)
+    schema = pa.csv.open_csv(openSource(), read_options=readOptions).schema
+    if yearColumn not in schema.names:
+        raise ValueError(f"out-of-core mode needs a '{yearColumn}' column")
+    if not isNumericType(pa, schema.field(yearColumn).type):
+        raise ValueError(f"the '{yearColumn}' column is not numeric")
+    columnTypes = {field.name: pa.float64() for field in schema
+                   if field.name != yearColumn and (pa.types.is_integer(field.type) or pa.types.is_null(field.type))}
+    reader = pa.csv.open_csv(openSource(), read_options=readOptions,
+                             convert_options=pa.csv.ConvertOptions(column_types=columnTypes))
+    manifest = {"rows": 0, "nullCounts": dict.fromkeys(reader.schema.names, 0), "min": {}, "max": {}}
+    written = 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with pa.OSFile(tmpPath, "wb") as sink, pa.ipc.new_file(sink, reader.schema) as writer:
+            for batch in reader:
+                if batch.num_rows == 0:
+                    continue
+                writer.write_batch(batch)
+                written += 1
+                manifest["rows"] += batch.num_rows
+                for name, column in zip(batch.schema.names, batch.columns):
+                    manifest["nullCounts"][name] += column.null_count
+                    if isNumericType(pa, column.type) and column.null_count < len(column):
+                        bounds = pa.compute.min_max(column)
+                        low, high = bounds["min"].as_py(), bounds["max"].as_py()
+                        manifest["min"][name] = low if name not in manifest["min"] else min(manifest["min"][name], low)
+                        manifest["max"][name] = high if name not in manifest["max"] else max(manifest["max"][name], high)
+                if progress is not None:
+                    progress(written * readOptions.block_size / max(totalBytes, 1))
+        os.replace(tmpPath, path)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+    with open(path + ".json", "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle)
+    if progress is not None:
+        progress(1.0)
+    return manifest
+
+
+def readManifest(path):
+    try:
+        with open(path + ".json", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+#******************************************************************************************************************************
+# Memory-mapped store
+# Batches are read straight out of the mapped file one at a time, the only query is the yearly reduction.
+# The store carries a datasetKey like a loaded frame, so everything derived from it goes through the shared derived cache.
+class ArrowStore:
+    def __init__(self, key, path, manifest, yearColumn='Year'):
+        self.pa = importArrow()
+        self.key = key
+        self.path = path
+        self.manifest = manifest
+        self.yearColumn = yearColumn
+        self.reader = self.pa.ipc.open_file(self.pa.memory_map(path, "r"))
+        self.schema = self.reader.schema
+        self.attrs = {'datasetKey': f"store-{key}"}
+        # columns without a single value are dropped, the same as a regular upload
+        self.columns = pd.Index([name for name in self.schema.names if manifest["nullCounts"][name] < manifest["rows"]])
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.manifest["rows"]
+
+    def cacheBytes(self):
+        # the rows live in the page cache, not on the Python heap
+        return 0
+
+    def copy(self, deep=False):
+        # the session registry hands out shallow copies, a store is read-only so it is shared as it is
+        return self
+
+    def diskBytes(self):
+        return os.path.getsize(self.path)
+
+    def numericColumns(self):
+        return [name for name in self.columns
+                if name != self.yearColumn and isNumericType(self.pa, self.schema.field(name).type)]
+
+    def batchCount(self):
+        return self.reader.num_record_batches
+
+    def batch(self, index):
+        with self.lock:
+            return self.reader.get_batch(index)
+
+    def batches(self, columns):
+        for index in range(self.batchCount()):
+            yield self.batch(index).select(columns)
+
+    def yearly(self, how, columns=None):
+        # every batch is grouped by year on its own, the partial sums and counts are then combined,
+        # so the peak is one batch plus one row per year and batch
+        columns = self.numericColumns() if columns is None else list(columns)
+        yearColumn = self.yearColumn
+        partials = []
+        for batch in self.batches([yearColumn] + columns):
+            table = self.pa.Table.from_batches([batch])
+            partials.append(table.group_by(yearColumn).aggregate([(name, "sum") for name in columns] +
+                                                                 [(name, "count") for name in columns]))
+        if not partials:
+            return pd.DataFrame(columns=[yearColumn] + columns)
+        combined = self.pa.concat_tables(partials).group_by(yearColumn).aggregate(
+            [(f"{name}_sum", "sum") for name in columns] + [(f"{name}_count", "sum") for name in columns]).to_pandas()
+        combined = combined[combined[yearColumn].notna()].sort_values(yearColumn, ignore_index=True)
+        yearly = pd.DataFrame({yearColumn: combined[yearColumn].to_numpy()})
+        for name in columns:
+            sums = combined[f"{name}_sum_sum"].to_numpy(dtype='float64', na_value=np.nan)
+            counts = combined[f"{name}_count_sum"].to_numpy(dtype='float64')
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = sums / counts if how == "Mean" else sums
+            yearly[name] = np.where(counts > 0, values, np.nan)
+        return yearly
+
+
+storeCache = dataEngine.LruCache(STORE_ENTRIES)
+
+
+class StoreDirectory(dataEngine.DiskCache):
+    # the upload cache's last-used eviction, a store is its .arrow file plus the manifest next to it
+    suffix = ".arrow"
+
+    def remove(self, key):
+        # an open memory map keeps its pages after the file is unlinked, sessions still using a store are unaffected
+        storeCache.discard(key)
+        super().remove(key)
+        try:
+            os.remove(self.pathFor(key) + ".json")
+        except OSError:
+            pass
+
+
+storeDirectory = StoreDirectory(STORE_DIR, STORE_MB * 1024 * 1024)
+
+
+def isStore(data):
+    return isinstance(data, ArrowStore)
+
+
+def openStore(source, yearColumn='Year', progress=None):
+    pa = importArrow()
+    key = sourceKey(source)
+    store = storeCache.get(key)
+    if store is None:
+        path = storeDirectory.pathFor(key)
+        manifest = readManifest(path) if os.path.exists(path) else None
+        if manifest is None:
+            # both sources hand out zero-copy blocks, a plain file stream would read far ahead of the writer
+            raw = None if isPath(source) else uploadBuffer(source)
+            openSource = (lambda: pa.memory_map(os.fspath(source))) if raw is None else (lambda: pa.BufferReader(pa.py_buffer(raw)))
+            manifest = writeStore(pa, openSource, path, yearColumn, dataEngine.uploadSize(source), progress)
+        else:
+            # mtime doubles as the last-used stamp for eviction
+            os.utime(path)
+        store = storeCache.put(key, ArrowStore(key, path, manifest, yearColumn))
+        storeDirectory.evict()
+    return store
+
+
+def yearlyFrame(store, how):
+    # pages see one row per year, keyed like any other dataset so indexes, null handling and figures cache as usual
+    def compute():
+        return dataEngine.withDatasetKey(store.yearly(how), f"{dataEngine.datasetKey(store)}|yearly|{how}")
+    return dataEngine.cachedDerived(store, 'yearly', compute, how).copy(deep=False)
+
+
+def storeBytes():
+    return sum(entry["bytes"] for entry in storeDirectory.entries())
+
+
+def clearStores():
+    storeCache.clear()
+    storeDirectory.clear()
+#******************************************************************************************************************************
+# Store profile
+# Same sections as the in-memory profile, answered from the schema, the manifest and single-batch reads.
+class StoreProfile(dataEngine.DatasetProfile):
+    def computeSection(self, name, store):
+        columns = list(store.columns)
+        if name == "head":
+            return store.pa.Table.from_batches([store.batch(0).select(columns).slice(0, 5)]).to_pandas()
+        if name == "dtypes":
+            return pd.Series({column: str(store.schema.field(column).type) for column in columns}, name="dtype")
+        if name == "nullCounts":
+            return pd.Series({column: store.manifest["nullCounts"][column] for column in columns})
+        if name == "minMax":
+            numeric = [column for column in columns if column in store.manifest["min"]]
+            return pd.DataFrame({"min": [store.manifest["min"][column] for column in numeric],
+                                 "max": [store.manifest["max"][column] for column in numeric]}, index=numeric)
+        if name == "memory":
+            usage = pd.Series(0, index=columns, dtype='int64')
+            for batch in store.batches(columns):
+                for column in columns:
+                    usage[column] += batch.column(column).nbytes
+            return pd.DataFrame({"bytes on disk": usage, "MB": (usage / 1024**2).round(3)})
+        if name == "cardinality":
+            # exact counts for labels and years, floating columns of a gridded extract would need every value in memory
+            distinct = {}
+            for column in columns:
+                if store.pa.types.is_floating(store.schema.field(column).type):
+                    distinct[column] = None
+                    continue
+                seen = None
+                for batch in store.batches([column]):
+                    values = store.pa.compute.unique(batch.column(column))
+                    seen = values if seen is None else store.pa.compute.unique(store.pa.concat_arrays([seen, values]))
+                distinct[column] = 0 if seen is None else len(seen) - seen.null_count
+            return pd.Series(distinct, name="distinct values")
+        raise KeyError(name)
+
+
+def storeProfile(store):
+    return dataEngine.cachedDerived(store, 'profile', StoreProfile)